@@ -0,0 +1,156 @@
+# codon adaptation scoring: Codon Adaptation Index (CAI, Sharp & Li 1987) and tRNA Adaptation Index (tAI, dos Reis 2004)
+# a WeightTable holds the log weight of each of the 64 codon slots, built once from reference data and saved as JSON,
+# so any number of sequences are scored by one matrix product with their codon counts
+import json
+import numpy as np
+import analysis
+from genetic_codes import get_genetic_code
+
+# dos Reis et al. 2004 wobble penalties (s values), keys are anticodon 1st base : codon 3rd base pairs (I is inosine)
+default_s_values = {'G:U': 0.41, 'I:C': 0.28, 'I:A': 0.9999, 'U:G': 0.68}
+
+"""
+Log weights of the codon slots for one adaptation index
+A sequence's score is the geometric mean of the weights of its scored codons: exp(counts @ log_weights / scored codons)
+"""
+class WeightTable:
+    """
+    :param str kind: 'cai' or 'tai'
+    :param log_weights: 64 natural log weights ordered like analysis.codon_list (0 for codons that are not scored)
+    :param scored: 64 booleans, True for the codons that count towards the score
+    :param int genetic_code: NCBI table number the weights were built for
+    :param dict info: anything else worth keeping with the table (for example where the reference came from)
+    """
+    def __init__(self, kind: str, log_weights, scored, genetic_code: int = 1, info=None):
+        self.kind = kind
+        self.log_weights = np.asarray(log_weights, dtype=float)
+        self.scored = np.asarray(scored, dtype=bool)
+        self.genetic_code = genetic_code
+        self.info = info or {}
+
+    """
+    Scores one sequence or every row of a codon count matrix in one pass
+
+    :param codon_data: codon counts as a dict, a 64 count array or an N x 64 matrix (see analysis.codon_count_matrix)
+    :return: the score (0 to 1) of each row, nan for rows without scored codons
+    :rtype: float or numpy.ndarray
+    """
+    def score(self, codon_data):
+        counts = analysis.as_codon_array(codon_data)
+        n_scored = counts @ self.scored
+        total = counts @ self.log_weights
+        return np.exp(np.divide(total, n_scored, out=np.full(np.shape(n_scored), np.nan), where=n_scored != 0))
+
+    """
+    Saves the table as JSON
+
+    :param str path: file to write
+    """
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            json.dump({
+                'kind': self.kind,
+                'genetic_code': self.genetic_code,
+                # weights of the scored codons only, the rest are not scored
+                'weights': {codon: float(np.exp(log_weight)) for codon, log_weight, scored
+                            in zip(analysis.codon_list, self.log_weights, self.scored) if scored},
+                'info': self.info,
+            }, file, indent=2)
+
+"""
+Loads a table saved with WeightTable.save
+
+:param str path: JSON file
+:return: the table
+:rtype: WeightTable
+"""
+def load_weights(path: str):
+    with open(path) as file:
+        data = json.load(file)
+    scored = np.array([codon in data['weights'] for codon in analysis.codon_list])
+    log_weights = np.array([np.log(data['weights'][codon]) if codon in data['weights'] else 0.0
+                            for codon in analysis.codon_list])
+    return WeightTable(data['kind'], log_weights, scored, data.get('genetic_code', 1), data.get('info'))
+
+"""
+Builds CAI weights from the codon usage of a reference set of (highly expressed) genes: the relative adaptiveness
+of a codon is its count divided by the count of the most used codon of its amino acid.
+Amino acids with one codon and stop codons are not scored
+
+:param reference_counts: codon counts of the reference genes, a 64 count array or an N x 64 matrix (rows are summed)
+:param code: NCBI table number or compiled genetic code (see genetic_codes)
+:param float pseudocount: count given to codons missing from the reference, so their weight is not 0 (Sharp & Li 1987)
+:return: the CAI weights
+:rtype: WeightTable
+"""
+def cai_weights(reference_counts, code=1, pseudocount: float = 0.5):
+    code = get_genetic_code(code)
+    counts = analysis.as_codon_array(reference_counts).astype(float)
+    if counts.ndim > 1:
+        counts = counts.sum(axis=0)
+    counts = np.where(counts > 0, counts, pseudocount)
+
+    # most used codon of each amino acid, per codon slot
+    family_max = np.zeros(len(code.amino_acid_list))
+    np.maximum.at(family_max, code.codon_aa_index, counts)
+    scored = code.synonymous_mask
+    log_weights = np.where(scored, np.log(counts / family_max[code.codon_aa_index]), 0.0)
+    return WeightTable('cai', log_weights, scored, code.table_id,
+                       {'reference_codons': int(counts[counts > pseudocount].sum()), 'pseudocount': pseudocount})
+
+"""
+Reads tRNA gene copy numbers, one anticodon and its number of genes per line (for example 'GCC 16'),
+lines starting with # are skipped
+
+:param str path: text file
+:return: keys are anticodons (dna or rna, 5' to 3'), values are gene copy numbers
+:rtype: dict
+"""
+def read_trna_counts(path: str):
+    trna_counts = {}
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) >= 2 and not fields[0].startswith('#'):
+                anticodon = fields[0].upper().replace('T', 'U')
+                trna_counts[anticodon] = trna_counts.get(anticodon, 0) + float(fields[1])
+    return trna_counts
+
+"""
+Builds tAI weights from tRNA gene copy numbers (dos Reis et al. 2004)
+The absolute adaptiveness of a codon sums the copy numbers of the tRNAs that read it, with wobble pairs penalized
+by their s value; tRNAs with anticodon ANN are counted as INN (inosine). Codons no tRNA reads get the geometric mean
+of the other weights. Stop codons and Met (AUG) are not scored
+
+:param dict trna_counts: keys are anticodons, values are gene copy numbers (see read_trna_counts)
+:param code: NCBI table number or compiled genetic code (see genetic_codes)
+:param dict s_values: wobble penalties, keys like 'G:U' (anticodon 1st base : codon 3rd base), see default_s_values
+:return: the tAI weights
+:rtype: WeightTable
+"""
+def tai_weights(trna_counts: dict, code=1, s_values=None):
+    code = get_genetic_code(code)
+    s = dict(default_s_values, **(s_values or {}))
+    trna = {anticodon.upper().replace('T', 'U'): count for anticodon, count in trna_counts.items()}
+    complement = {'U': 'A', 'C': 'G', 'A': 'U', 'G': 'C'}
+
+    # anticodon 1st base that reads each codon 3rd base, with its penalty (0 for watson-crick pairs)
+    readers = {
+        'U': [('A', 0.0), ('G', s['G:U'])],     # ANN is read as INN, I:U pairs like watson-crick
+        'C': [('G', 0.0), ('A', s['I:C'])],
+        'A': [('U', 0.0), ('A', s['I:A'])],
+        'G': [('C', 0.0), ('U', s['U:G'])],
+    }
+    absolute = np.zeros(64)
+    for i, codon in enumerate(analysis.codon_list):
+        # the anticodon's 2nd and 3rd bases pair with the codon's 2nd and 1st bases
+        rest = complement[codon[1]] + complement[codon[0]]
+        absolute[i] = sum((1 - penalty) * trna.get(first + rest, 0) for first, penalty in readers[codon[2]])
+
+    scored = ~code.stop_mask[:64] & (np.array(analysis.codon_list) != 'AUG')
+    relative = absolute / absolute[scored].max() if absolute[scored].max() > 0 else absolute
+    read = scored & (relative > 0)
+    fill = np.exp(np.log(relative[read]).mean()) if read.any() else 1.0
+    relative = np.where(scored & ~read, fill, relative)
+    log_weights = np.where(scored, np.log(np.where(scored, relative, 1.0)), 0.0)
+    return WeightTable('tai', log_weights, scored, code.table_id, {'s_values': s, 'trna_genes': float(sum(trna.values()))})
@@ -1,4 +1,4 @@
-#from Bio.SeqUtils.CodonUsage import CodonAdaptationIndex, SharpEcoliIndex
+import numpy as np
 
 codon_table = {
     'UUU': 'F', 'UUC': 'F', 'UUA': 'L', 'UUG': 'L', 
@@ -26,6 +26,137 @@ for key, val in codon_table.items():
         rev_codon_table[val].append(key)
     else:
         rev_codon_table[val] = [key]
+
+# fixed ordering used by all array based functions, index i of a 64 slot count array is codon_list[i]
+codon_list = list(codon_table)
+amino_acid_list = list(rev_codon_table)
+
+# for each codon slot: index of the amino acid it codes for, and the number of synonymous codons for that amino acid
+codon_aa_index = np.array([amino_acid_list.index(codon_table[codon]) for codon in codon_list])
+codon_family_size = np.array([len(rev_codon_table[codon_table[codon]]) for codon in codon_list])
+# expected fraction of its amino acid for each codon if synonymous codons were used evenly
+codon_expected_freq = 1 / codon_family_size
+# 64 x 21 matrix with a 1 where the codon (row) codes for the amino acid (column), so codon counts @ it = amino acid counts
+codon_aa_matrix = np.zeros((64, len(amino_acid_list)), dtype=np.int64)
+codon_aa_matrix[np.arange(64), codon_aa_index] = 1
+# True for the codon slots whose 3rd base is G or C
+codon_gc3_mask = np.array([codon[2] in 'GC' for codon in codon_list])
+# True for the stop codon slots, and for the slots of amino acids coded by more than one codon (not stops)
+codon_stop_mask = np.array([codon_table[codon] == '*' for codon in codon_list])
+codon_synonymous_mask = (codon_family_size > 1) & ~codon_stop_mask
+
+# maps every byte value to a 2 bit base code (U/T=0, C=1, A=2, G=3), anything else is 64 (invalid)
+base_codes = np.full(256, 64, dtype=np.uint8)
+for code, bases in enumerate(['UuTt', 'Cc', 'Aa', 'Gg']):
+    for base in bases:
+        base_codes[ord(base)] = code
+
+# True for the byte values of G and C bases (either case)
+gc_base_mask = np.zeros(256, dtype=bool)
+gc_base_mask[np.frombuffer(b'GCgc', dtype=np.uint8)] = True
+
+# base codes of the 3 bases of each codon slot, and the number of U, C, A, G bases in each codon (64 x 4)
+codon_base_codes = np.array([['UCAG'.index(base) for base in codon] for codon in codon_list])
+codon_base_counts = np.zeros((64, 4))
+for position in range(3):
+    codon_base_counts[np.arange(64), codon_base_codes[:, position]] += 1
+
+# codon_table is ordered by 2nd base, then 1st base, then 3rd base,
+# so the slot of a codon is 16 * 2nd + 4 * 1st + 3rd
+codon_slot_weights = np.array([4, 16, 1], dtype=np.intp)
+
+"""
+Returns a sequence as bytes, without copying sequences that already are
+Characters of a str that are not ascii become '?', an invalid base, so every base keeps its position
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:return: one byte per base
+:rtype: bytes
+"""
+def sequence_bytes(sequence):
+    if isinstance(sequence, str):
+        return sequence.encode('ascii', 'replace')
+    return sequence
+
+"""
+Converts a sequence to an array of codon slots (indices into codon_list), one per complete codon
+Trailing bases that do not make up a full codon are ignored
+
+:param sequence: the dna or rna sequence to be converted, as a str, bytes or uint8 array
+:return: codon slots, values 0-63 for valid codons and >= 64 for codons containing an invalid base
+:rtype: numpy.ndarray
+"""
+def codon_indices(sequence):
+    raw = np.frombuffer(sequence_bytes(sequence), dtype=np.uint8)
+    n_codons = len(raw) // 3
+    codes = base_codes[raw[:n_codons * 3]].reshape(n_codons, 3)
+    # an invalid base (code 64) pushes the slot past 63 whatever its position in the codon
+    return codes @ codon_slot_weights
+
+"""
+Counts each codon in one vectorized pass, with one extra bucket for codons that contain an ambiguous or invalid base
+(N, R, Y, ... or anything other than A, C, G, T, U), so clean sequences pay nothing for the check
+
+:param sequence: the sequence to be analyzed, as a str or bytes
+:return: 65 counts, index i < 64 is the count of codon_list[i], index 64 is the number of invalid codons
+:rtype: numpy.ndarray
+"""
+def codon_tally(sequence):
+    tally = np.bincount(codon_indices(sequence), minlength=65)
+    if len(tally) > 65:
+        # invalid codons have slots 64 and up, fold them into one bucket
+        tally[64] = tally[64:].sum()
+        tally = tally[:65]
+    return tally
+
+"""
+Finds the first codon that contains an invalid base
+
+:param sequence: the sequence to be analyzed, as a str or bytes
+:return: the codon (upper case rna), or None if every codon is valid
+:rtype: str
+"""
+def first_invalid_codon(sequence):
+    idx = codon_indices(sequence)
+    if not len(idx) or idx.max() < 64:
+        return None
+    bad = int(np.argmax(idx > 63))
+    codon = sequence[bad*3:bad*3+3]
+    if not isinstance(codon, str):
+        codon = bytes(codon).decode('latin-1')
+    return codon.upper().replace('T', 'U')
+
+"""
+Computes the number of each codon present as an array
+
+:param sequence: the sequence to be analyzed, as a str or bytes
+:param str invalid: what to do with codons that contain an ambiguous or invalid base (see codon_tally),
+                    'raise' to raise a KeyError, 'skip' to leave them out of the counts
+:return: codon counts, index i is the count of codon_list[i]
+:rtype: numpy.ndarray
+"""
+def codon_counts(sequence, invalid: str = 'raise'):
+    if invalid not in ('raise', 'skip'):
+        raise ValueError(f"invalid must be 'raise' or 'skip', not {invalid!r}")
+    tally = codon_tally(sequence)
+    if tally[64] and invalid == 'raise':
+        # same error as a dict lookup of an unknown codon
+        raise KeyError(first_invalid_codon(sequence))
+    return tally[:64]
+
+"""
+Converts codon counts given as a dict (keys are codons) to an array ordered like codon_list
+Arrays are returned unchanged
+
+:param codon_data: codon counts as a dict or array
+:return: codon counts as an array
+:rtype: numpy.ndarray
+"""
+def as_codon_array(codon_data):
+    if isinstance(codon_data, dict):
+        return np.array([codon_data[codon] for codon in codon_list])
+    return np.asarray(codon_data)
+
 """
 Computes the number of each codon present
 
@@ -34,85 +165,300 @@ Computes the number of each codon present
 :rtype: dict
 """
 def analyze_codons(sequence: str,):
-    sequence = sequence.upper()
-    sequence = sequence.replace('T', 'U') # in case sequence was dna
+    return dict(zip(codon_list, codon_counts(sequence).tolist()))
 
-    idx = 0
+"""
+Computes the codon counts of many sequences at once, each sequence is only counted once and the
+result can be passed to amino_acid_counts, rscu_values, enc_values and gc3_values to get all rows in one pass
 
-    count = {key: 0 for key in codon_table}
-    total = 0
-    while idx < len(sequence) - 2:
-        codon = sequence[idx:idx+3]
-        count[codon] += 1
+:param seqs: the sequences to be analyzed (str or bytes each)
+:param str invalid: 'raise' or 'skip', see codon_counts
+:return: N x 64 matrix, row i is codon_counts(seqs[i])
+:rtype: numpy.ndarray
+"""
+def codon_count_matrix(seqs, invalid: str = 'raise'):
+    rows = [codon_counts(seq, invalid) for seq in seqs]
+    if not rows:
+        return np.zeros((0, 64), dtype=np.int64)
+    return np.vstack(rows)
 
-        total += 1
-        idx += 3
+"""
+Computes the number of each amino acid present as an array
 
-    return count
+:param codon_data: codon counts as a dict, a 64 count array (see codon_counts) or an N x 64 matrix (see codon_count_matrix)
+:param GeneticCode code: genetic code to translate with (see genetic_codes.get_genetic_code), None for the standard code
+:return: amino acid counts, index i (of each row) is the count of amino_acid_list[i] (code.amino_acid_list)
+:rtype: numpy.ndarray
+"""
+def amino_acid_counts(codon_data, code=None):
+    matrix = codon_aa_matrix if code is None else code.codon_aa_matrix
+    return as_codon_array(codon_data) @ matrix
 
 """
 Computes the number of each amino acid present
 
-:param dict codons: keys are codons and values are count of how many times they appear, this can be the first value in the analyze_codon output tuple
+:param codons: keys are codons and values are count of how many times they appear (output of analyze_codons),
+               or an array of counts (output of codon_counts)
+:param GeneticCode code: genetic code to translate with, None for the standard code
 :return: amino acid counts (keys are amino acids, values are counts) 
 :rtype: dict
 """
-def analyze_amino_acids(data: dict):
-    # initialize map, keys are amino acids, values set to zero
-    count = {key: 0 for key in rev_codon_table}
-    # go through all amino acids
-    for amino_acid, codons in rev_codon_table.items():
-        # for each codon, add count to corresponding amino acid
-        for codon in codons:
-            count[amino_acid] += data[codon]
-    return count
+def analyze_amino_acids(data, code=None):
+    aa_list = amino_acid_list if code is None else code.amino_acid_list
+    return dict(zip(aa_list, amino_acid_counts(data, code).tolist()))
+
+"""
+Computes the Relative Synonymous Codon Usage (RSCU) scores as an array
+
+:param codon_data: codon counts as a dict, a 64 count array or an N x 64 matrix
+:param amino_acid_data: amino acid counts as a dict or array, computed from codon_data if not given
+:param GeneticCode code: genetic code to group synonymous codons by, None for the standard code
+:return: rscu, index i (of each row) is the rscu of codon_list[i]
+:rtype: numpy.ndarray
+"""
+def rscu_values(codon_data, amino_acid_data=None, code=None):
+    aa_list, aa_index, expected_freq = (amino_acid_list, codon_aa_index, codon_expected_freq) if code is None \
+        else (code.amino_acid_list, code.codon_aa_index, code.codon_expected_freq)
+    counts = as_codon_array(codon_data)
+    if amino_acid_data is None:
+        aa_counts = amino_acid_counts(counts, code)
+    elif isinstance(amino_acid_data, dict):
+        aa_counts = np.array([amino_acid_data[aa] for aa in aa_list])
+    else:
+        aa_counts = np.asarray(amino_acid_data)
+
+    # observed count of the codon / count of its amino acid, per codon slot
+    totals = aa_counts[..., aa_index]
+    observed = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals != 0)  # avoid divide by 0 error
+    # rscu = observed freq / theoretical freq, theoretical fraction is 1/(num of codons for that amino acid)
+    return observed / expected_freq
 
 """
 Computes the Relative Synonymous Codon Usage (RSCU) scores
 
-:param dict codon_data: keys are codons, values are counts
-:param dict amino_acid_data: keys are amino acids, values are counts
+:param codon_data: keys are codons, values are counts (or an array from codon_counts)
+:param amino_acid_data: keys are amino acids, values are counts (or an array from amino_acid_counts)
+:param GeneticCode code: genetic code to group synonymous codons by, None for the standard code
 :return: rscu, keys are codons, values are rscu
 :rtype: dict
 """
-def rscu(codon_data: dict, amino_acid_data: dict):
-    rscu = {key: 0.0 for key in codon_table}
-    for codon, amino_acid in codon_table.items():
-        # theoretical fraction is 1/(num of codons for that amino acid)
-        perfect = 1 / len(rev_codon_table[amino_acid])
-        if amino_acid_data[amino_acid] != 0:    # avoid divide by 0 error
-            # rscu = observed freq / theoretial freq
-            rscu[codon] = (codon_data[codon] / amino_acid_data[amino_acid]) / perfect
-        else:
-            rscu[codon] = 0.0
-    return rscu
+def rscu(codon_data, amino_acid_data, code=None):
+    return dict(zip(codon_list, rscu_values(codon_data, amino_acid_data, code).tolist()))
+
+"""
+Splits the rows of a matrix into groups of similar rows with k-means clustering
+The starting centers are evenly spaced rows, so the result is the same on every run
+
+:param data: N x M matrix (for example rscu_values of a codon count matrix)
+:param int n_groups: number of groups, at most N
+:param int iterations: maximum number of k-means iterations
+:return: group number (0 to n_groups-1) of each row
+:rtype: numpy.ndarray
+"""
+def group_rows(data, n_groups: int, iterations: int = 20):
+    data = np.asarray(data, dtype=float)
+    n_groups = min(n_groups, len(data))
+    centers = data[np.linspace(0, len(data) - 1, n_groups).astype(int)]
+    labels = np.zeros(len(data), dtype=np.intp)
+    for iteration in range(iterations):
+        # squared distance of every row to every center, without building an N x k x M array
+        dist = (data**2).sum(axis=1)[:, None] - 2 * data @ centers.T + (centers**2).sum(axis=1)[None, :]
+        new_labels = dist.argmin(axis=1)
+        if iteration > 0 and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=n_groups)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, data)
+        filled = sizes > 0  # groups that lost all their rows keep their old center
+        centers[filled] = sums[filled] / sizes[filled, None]
+    return labels
 
 """
 Computes the GC content of the sequence
 
-:param str sequence: the dna or rna sequence to be analyzed
+:param sequence: the dna or rna sequence to be analyzed, as a str or bytes
 :return: the gc content as a percentage
 :rtype: float
 """
-def gc(sequence: str):
-    lower_seq = sequence.lower()
-    g = lower_seq.count('g')
-    c = lower_seq.count('c')
-    return round((g+c) / len(sequence) * 100, 4)
+def gc(sequence):
+    g_c = np.count_nonzero(gc_base_mask[np.frombuffer(sequence_bytes(sequence), dtype=np.uint8)])
+    return round(g_c / len(sequence) * 100, 4)
 
 """
-Computes the Effective Number of Codons (ENC)
-Ranges from 20 (only one codon used per amino acid)
-to 61 (all codons used )
+Counts the G/C bases of every window along the sequence in linear time using a running count of G/C bases
+Window i covers bases i*step to i*step + window_size, starting positions stop before len(sequence) - window_size
 
-:param str sequence: the sequence to be analyzed
-:return: the ENC
-:rtype: int
-"""
-def enc(sequence: str):
-    codon_usage = analyze_codons(sequence)
-    count = 0
-    for key, value in codon_usage.items():
-        if value != 0:
-            count += 1
-    return count
\ No newline at end of file
+:param sequence: the dna or rna sequence to be analyzed, as a str or bytes
+:param int window_size: number of bases in each window
+:param int step: distance between the starts of consecutive windows
+:return: number of g/c bases in each window
+:rtype: numpy.ndarray
+"""
+def gc_window_counts(sequence, window_size: int, step: int = 1):
+    raw = np.frombuffer(sequence_bytes(sequence), dtype=np.uint8)
+
+    # running count of g/c bases, cumulative[i] = number of g/c in the first i bases
+    is_gc = gc_base_mask[raw]
+    cumulative = np.zeros(len(raw) + 1, dtype=np.int32 if len(raw) < 2**31 else np.int64)
+    np.cumsum(is_gc, out=cumulative[1:])
+
+    starts = np.arange(0, max(len(raw) - window_size, 0), step)
+    return cumulative[starts + window_size] - cumulative[starts]
+
+"""
+Converts window g/c counts to percentages, rounded exactly like gc()
+A window can only hold 0..window_size g/c bases, so the percentages are looked up from a
+table instead of rounding every window
+
+:param window_counts: number of g/c bases in each window (see gc_window_counts)
+:param int window_size: number of bases in each window
+:return: gc content of each window as a percentage (float32, 4 bytes per window)
+:rtype: numpy.ndarray
+"""
+def gc_window_percent(window_counts, window_size: int):
+    table = np.array([round(k / window_size * 100, 4) for k in range(window_size + 1)], dtype=np.float32)
+    return table[window_counts]
+
+"""
+Computes the GC content of every window along the sequence in linear time (see gc_window_counts)
+
+:param sequence: the dna or rna sequence to be analyzed, as a str or bytes
+:param int window_size: number of bases in each window
+:param int step: distance between the starts of consecutive windows
+:return: gc content of each window as a float32 percentage, rounded like gc()
+:rtype: numpy.ndarray
+"""
+def gc_profile(sequence, window_size: int, step: int = 1):
+    return gc_window_percent(gc_window_counts(sequence, window_size, step), window_size)
+
+"""
+Computes the GC content of codon positions 1 and 2 together, and of codon position 3
+
+:param sequence: the dna or rna sequence to be analyzed, as a str or bytes
+:return: (gc12, gc3) as percentages
+:rtype: tuple
+"""
+def gc_codon_positions(sequence):
+    gc12 = gc(sequence[0::3] + sequence[1::3])
+    gc3 = gc(sequence[2::3])
+    return gc12, gc3
+
+"""
+Computes the GC content of codon position 3 (GC3) from codon counts
+
+:param codon_data: a 64 count array or an N x 64 matrix (see codon_count_matrix)
+:return: GC3 as a percentage rounded like gc(), one per row
+:rtype: float or numpy.ndarray
+"""
+def gc3_values(codon_data):
+    counts = as_codon_array(codon_data)
+    total = counts.sum(axis=-1)
+    gc3 = np.divide(counts[..., codon_gc3_mask].sum(axis=-1), total, out=np.zeros(np.shape(total)), where=total != 0)
+    return np.round(gc3 * 100, 4)
+
+"""
+Computes the GC content of synonymous codon position 3 (GC3s) from codon counts: like GC3, but only over codons of
+amino acids with more than one codon (so without Met, Trp and stop codons in the standard code)
+
+:param codon_data: a 64 count array or an N x 64 matrix (see codon_count_matrix)
+:param GeneticCode code: genetic code that decides which codons are synonymous (see genetic_codes), None for the standard code
+:return: GC3s as a percentage rounded like gc(), one per row
+:rtype: float or numpy.ndarray
+"""
+def gc3s_values(codon_data, code=None):
+    synonymous = codon_synonymous_mask if code is None else code.synonymous_mask
+    counts = as_codon_array(codon_data)[..., synonymous]
+    total = counts.sum(axis=-1)
+    gc3s = np.divide(counts[..., codon_gc3_mask[synonymous]].sum(axis=-1), total, out=np.zeros(np.shape(total)),
+                     where=total != 0)
+    return np.round(gc3s * 100, 4)
+
+"""
+Computes the Effective Number of Codons (ENC, Wright 1990)
+Ranges from 20 (only one codon used per amino acid) to 61 (all synonymous codons used equally)
+
+:param sequence: the sequence to be analyzed (str or bytes), or its codon counts as an array
+:param GeneticCode code: genetic code to group synonymous codons by, None for the standard code
+:param str method: 'wright' or 'novembre', see enc_values
+:return: the ENC, nan if it can not be computed
+:rtype: float
+"""
+def enc(sequence, code=None, method: str = 'wright'):
+    if isinstance(sequence, (str, bytes)):
+        sequence = codon_counts(sequence)
+    return float(enc_values(sequence, code, method))
+
+"""
+Computes the Effective Number of Codons (ENC) from codon counts, for one sequence or every row of a matrix in one pass
+
+For each amino acid with k > 1 codons seen n > 1 times, the homozygosity F is computed from its codon frequencies p:
+    'wright':   F = (n * sum(p^2) - 1) / (n - 1)                      (Wright 1990)
+    'novembre': F = (X^2 + n - k) / (k * (n - 1)), X^2 = n * sum((p - e)^2 / e)
+                with expected frequencies e from the base composition (Novembre 2002), which corrects for
+                composition bias; with an even composition it gives Wright's F
+The F of amino acids with the same number of codons are averaged (weighted by n for 'novembre') and
+ENC = number of amino acids with one codon + sum over codon family sizes of (number of amino acids / average F).
+A missing average for 3 codon families (Ile) is the mean of the 2 and 4 codon ones, otherwise the ENC is nan.
+The ENC is capped at the number of sense codons.
+
+:param codon_data: a 64 count array or an N x 64 matrix (see codon_count_matrix)
+:param GeneticCode code: genetic code to group synonymous codons by, None for the standard code
+:param str method: 'wright' or 'novembre'
+:param base_composition: 'novembre' only: U, C, A, G frequencies (4 values, or N x 4), expected codon frequencies are
+                         the product of the frequencies of their bases; computed from each row's codons if None
+:return: the ENC, one per row
+:rtype: float or numpy.ndarray
+"""
+def enc_values(codon_data, code=None, method: str = 'wright', base_composition=None):
+    if method not in ('wright', 'novembre'):
+        raise ValueError(f"method must be 'wright' or 'novembre', not {method!r}")
+    matrix, aa_index, stop = (codon_aa_matrix, codon_aa_index, codon_stop_mask) if code is None \
+        else (code.codon_aa_matrix, code.codon_aa_index, code.stop_mask[:64])
+
+    # amino acids (columns of matrix) grouped by the number of codons coding for them
+    family_size = matrix.sum(axis=0)
+    degenerate = (family_size > 1) & (stop @ matrix == 0)
+    classes = np.unique(family_size[degenerate])
+    class_matrix = ((family_size[:, None] == classes[None, :]) & degenerate[:, None]).astype(float)
+    n_single = np.count_nonzero((family_size == 1) & (stop @ matrix == 0))
+
+    counts = as_codon_array(codon_data).astype(float)
+    n = counts @ matrix
+    totals = n[..., aa_index]
+    p = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals != 0)
+    valid = (n > 1) & degenerate
+    if method == 'wright':
+        homozygosity = (p**2) @ matrix
+        F = np.divide(n * homozygosity - 1, n - 1, out=np.zeros(n.shape), where=valid)
+        weights = valid.astype(float)
+    else:
+        if base_composition is None:
+            # composition of all bases of the counted codons
+            base_composition = counts @ codon_base_counts
+        composition = np.asarray(base_composition, dtype=float)
+        # expected frequency of each codon within its amino acid
+        expected = composition[..., codon_base_codes].prod(axis=-1)
+        family_total = (expected @ matrix)[..., aa_index]
+        expected = np.divide(expected, family_total, out=np.zeros(np.broadcast(expected, family_total).shape),
+                             where=family_total != 0)
+        deviation = np.divide((p - expected)**2, expected, out=np.zeros(np.broadcast(p, expected).shape),
+                              where=expected != 0)
+        chi2 = n * (deviation @ matrix)
+        F = np.divide(chi2 + n - family_size, family_size * (n - 1), out=np.zeros(n.shape), where=valid)
+        weights = n * valid
+
+    # average F of each codon family size
+    weight_sums = weights @ class_matrix
+    F_class = np.divide((F * weights) @ class_matrix, weight_sums, out=np.full(weight_sums.shape, np.nan),
+                        where=weight_sums != 0)
+    if 3 in classes and 2 in classes and 4 in classes:
+        i2, i3, i4 = (int(np.flatnonzero(classes == k)[0]) for k in (2, 3, 4))
+        F3 = F_class[..., i3]
+        F_class[..., i3] = np.where(np.isnan(F3), (F_class[..., i2] + F_class[..., i4]) / 2, F3)
+
+    # an average F of 0 (every codon seen once) means as many codons as possible, which the cap below handles
+    n_families = class_matrix.sum(axis=0)
+    terms = np.divide(n_families, F_class, out=np.full(F_class.shape, np.inf), where=F_class > 0)
+    terms[np.isnan(F_class)] = np.nan
+    return np.minimum(n_single + terms.sum(axis=-1), np.count_nonzero(~stop))
@@ -0,0 +1,239 @@
+# runs main.run on many fasta files from one process: an asyncio scheduler hands the files to a fixed pool of worker
+# processes (so python, numpy and matplotlib are loaded once per worker, not once per file), retries files that fail,
+# and appends every finished file to a completion log so an interrupted batch can be resumed
+# usage: python batch.py manifest.txt --output results [--jobs 4] [--retries 2] [run options, see --help]
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+"""
+Generator over the jobs of a manifest file: one fasta file per line, optionally followed by a tab and the output
+folder for it (the default is <output_root>/<file name without extensions>). Empty lines and lines starting with # are skipped
+
+:param str manifest: path to the manifest, relative paths in it are relative to the manifest's folder
+:param str output_root: folder the default output folders are created in
+:return: yields (input file, output folder), both absolute paths
+:rtype: generator
+"""
+def read_manifest(manifest: str, output_root: str):
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            input_file = os.path.join(base_dir, fields[0].strip())
+            if len(fields) > 1 and fields[1].strip():
+                output_dir = os.path.join(base_dir, fields[1].strip())
+            else:
+                name = os.path.basename(input_file)
+                for ext in ('.gz', '.fasta', '.fa', '.fna', '.ffn', '.faa', '.fas'):
+                    if name.lower().endswith(ext):
+                        name = name[:-len(ext)]
+                output_dir = os.path.join(os.path.abspath(output_root), name)
+            yield input_file, output_dir
+
+"""
+Reads the input files that a completion log records as done
+
+:param str log_file: path to the log (JSON lines, see run_batch)
+:return: input files that finished in an earlier run
+:rtype: set
+"""
+def read_completed(log_file: str):
+    completed = set()
+    if not os.path.exists(log_file):
+        return completed
+    with open(log_file) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue    # last line cut off by an interrupted run
+            if entry.get('status') == 'done':
+                completed.add(entry['input'])
+    return completed
+
+"""
+Analyzes one fasta file in a worker process, the progress output goes to run.log in its output folder
+
+:param str input_file: fasta file to analyze
+:param str output_dir: folder to save output graphs and files to
+:param dict options: keyword arguments of main.run
+:return: (name, error message) for every record that failed (see main.run)
+:rtype: list
+"""
+def run_job(input_file: str, output_dir: str, options: dict):
+    import main     # imported once per worker process
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'run.log'), 'w') as log, contextlib.redirect_stdout(log):
+        return main.run(input_file, output_dir, **options)
+
+"""
+Runs main.run on every file of a manifest with a bounded pool of worker processes
+
+Files are handed to the workers through a bounded queue (at most 2 per worker waiting), so the scheduler never
+runs ahead of the workers. A file whose run raises is retried up to retries times; records that fail inside a run
+are not retried (see main.run). Each finished file is appended to the completion log as one JSON line, files already logged as done
+are skipped, so running the same command again resumes an interrupted batch.
+
+:param str manifest: manifest file (see read_manifest)
+:param str output_root: folder for the default output folders and the completion log
+:param int jobs: number of worker processes
+:param int retries: extra attempts for a file whose run raises
+:param str log_file: completion log, <output_root>/completed.jsonl if None
+:param dict options: keyword arguments passed to main.run for every file
+:return: number of files (done, failed, skipped)
+:rtype: tuple
+"""
+async def run_batch(manifest: str, output_root: str, jobs: int = 4, retries: int = 2, log_file=None, options=None):
+    options = dict(options or {}, workers=1)    # the parallelism is across files
+    os.makedirs(output_root, exist_ok=True)
+    if log_file is None:
+        log_file = os.path.join(output_root, 'completed.jsonl')
+    completed = await asyncio.to_thread(read_completed, log_file)
+    loop = asyncio.get_running_loop()
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    queue = asyncio.Queue(maxsize=2 * jobs)
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+    log = open(log_file, 'a')
+
+    # appends one line to the completion log, flushed so it survives the batch being killed
+    def write_log(entry):
+        log.write(json.dumps(entry) + '\n')
+        log.flush()
+
+    async def produce():
+        for job in await asyncio.to_thread(list, read_manifest(manifest, output_root)):
+            if job[0] in completed:
+                counts['skipped'] += 1
+                continue
+            await queue.put(job)    # waits while the queue is full
+        for _ in range(jobs):
+            await queue.put(None)
+
+    async def consume():
+        nonlocal pool
+        while (job := await queue.get()) is not None:
+            input_file, output_dir = job
+            start = time.perf_counter()
+            for attempt in range(1, retries + 2):
+                used_pool = pool
+                try:
+                    failed = await loop.run_in_executor(used_pool, run_job, input_file, output_dir, options)
+                    entry = {'input': input_file, 'output': output_dir, 'status': 'done', 'attempts': attempt,
+                             'failed_records': len(failed), 'seconds': round(time.perf_counter() - start, 3)}
+                    break
+                except BrokenProcessPool as e:
+                    # a worker died (for example out of memory), the other jobs need a new pool too
+                    error = f'{type(e).__name__}: {e}'
+                    if pool is used_pool:   # not replaced yet by another job that was running in it
+                        pool.shutdown(wait=False)
+                        pool = ProcessPoolExecutor(max_workers=jobs)
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+                if attempt <= retries:
+                    await asyncio.sleep(min(2 ** (attempt - 1), 30))
+            else:
+                entry = {'input': input_file, 'output': output_dir, 'status': 'failed', 'attempts': retries + 1,
+                         'error': error, 'seconds': round(time.perf_counter() - start, 3)}
+            counts[entry['status']] += 1
+            await asyncio.to_thread(write_log, entry)
+            print(f"[{counts['done']} done, {counts['failed']} failed] {entry['status']}: {input_file}")
+
+    try:
+        await asyncio.gather(produce(), *(consume() for _ in range(jobs)))
+    finally:
+        log.close()
+        pool.shutdown()
+    return counts['done'], counts['failed'], counts['skipped']
+
+"""
+Command line options, the run options have the same names and meaning as the PARAMETERS of main.py
+
+:return: the parser
+:rtype: argparse.ArgumentParser
+"""
+def build_parser():
+    parser = argparse.ArgumentParser(description='Analyze every fasta file listed in a manifest')
+    parser.add_argument('manifest', help='file with one fasta file per line, optionally followed by a tab and its output folder')
+    parser.add_argument('--output', default='batch_output', help='folder for the output folders and the completion log')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--retries', type=int, default=2, help='extra attempts for a file whose run fails')
+    parser.add_argument('--log', help='completion log, <output>/completed.jsonl by default')
+
+    run = parser.add_argument_group('run options (see main.py)')
+    run.add_argument('--fasta-parser', choices=['native', 'biopython'], default='native')
+    run.add_argument('--all', action='store_true', help='single sequence statistics for every sequence, not only the first')
+    run.add_argument('--compare', action='store_true', help='make the comparison graphs')
+    run.add_argument('--multi-only', action='store_true', help='only make the comparison graphs')
+    run.add_argument('--plot-format', default='png', help="'png', 'svg' or 'none'")
+    run.add_argument('--plot-dpi', type=int, default=300)
+    run.add_argument('--bulk-format', choices=['tsv', 'parquet'])
+    run.add_argument('--use-cache', action='store_true')
+    run.add_argument('--cache-file', default='', help='cache file shared by all files, one per output folder if empty')
+    run.add_argument('--genome-mode', action='store_true')
+    run.add_argument('--cds-source', help="'orf' or a GFF / GenBank file")
+    run.add_argument('--genetic-code', type=int, default=1)
+    run.add_argument('--invalid-codons', choices=['raise', 'skip'], default='raise')
+    run.add_argument('--enc-method', choices=['wright', 'novembre'], default='wright')
+    run.add_argument('--cai-reference')
+    run.add_argument('--trna-counts')
+    run.add_argument('--cpb-reference')
+    run.add_argument('--heatmap-order', choices=['input', 'cluster'], default='cluster')
+    run.add_argument('--heatmap-max-rows', type=int, default=0,
+                     help='most rows drawn in the RSCU heatmap, 0 for every sequence')
+    run.add_argument('--heatmap-reduce', choices=['group', 'sample'], default='group')
+    run.add_argument('--distance-metric', choices=['euclidean', 'cosine', 'chi-square', 'jensen-shannon'])
+    run.add_argument('--codon-window', type=int, help='codons per window of the local codon usage tracks')
+    run.add_argument('--codon-window-step', type=int, default=10)
+    run.add_argument('--report-timing', action='store_true')
+    return parser
+
+"""
+Converts parsed command line arguments to main.run keyword arguments
+
+:param argparse.Namespace args: parsed arguments (see build_parser)
+:return: keyword arguments of main.run
+:rtype: dict
+"""
+def run_options(args):
+    return {
+        'fasta_parser': args.fasta_parser,
+        'single_only': not args.all,
+        'compare': args.compare,
+        'multi_only': args.multi_only,
+        'plot_format': None if args.plot_format.lower() == 'none' else args.plot_format,
+        'plot_dpi': args.plot_dpi,
+        'bulk_format': args.bulk_format,
+        'use_cache': args.use_cache,
+        # an absolute path so every job finds the same file
+        'cache_file': os.path.abspath(args.cache_file) if args.cache_file else '',
+        'genome_mode': args.genome_mode,
+        'cds_source': args.cds_source if args.cds_source in (None, 'orf') else os.path.abspath(args.cds_source),
+        'genetic_code': args.genetic_code,
+        'invalid_codons': args.invalid_codons,
+        'enc_method': args.enc_method,
+        'cai_reference': os.path.abspath(args.cai_reference) if args.cai_reference else None,
+        'trna_counts': os.path.abspath(args.trna_counts) if args.trna_counts else None,
+        'cpb_reference': os.path.abspath(args.cpb_reference) if args.cpb_reference else None,
+        'heatmap_order': args.heatmap_order,
+        'heatmap_max_rows': args.heatmap_max_rows or None,
+        'heatmap_reduce': args.heatmap_reduce,
+        'distance_metric': args.distance_metric,
+        'codon_window': args.codon_window,
+        'codon_window_step': args.codon_window_step,
+        'report_timing': args.report_timing,
+    }
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    done, failed, skipped = asyncio.run(run_batch(args.manifest, args.output, args.jobs, args.retries, args.log,
+                                                  run_options(args)))
+    print(f"{done} file(s) done, {failed} failed, {skipped} already done")
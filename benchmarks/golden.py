@@ -0,0 +1,269 @@
+# regression gate: reruns the single and multi sequence examples on raw_data/test.fasta and checks their text outputs
+# against sample_outputs within a numeric tolerance and their graphs by perceptual hash, checks the numbers drawn in
+# the graphs (the bulk tables of every sequence, see bulk_output.BulkWriter) against benchmarks/golden, and optionally
+# checks the time of each stage (see timing.StageTimer) against a recorded baseline. Exits with status 1 if anything
+# fails
+# run from the repository root:
+#   python benchmarks/golden.py --record-baseline golden_timing.json     (once, on the reference version)
+#   python benchmarks/golden.py --baseline golden_timing.json [--max-slowdown 0.25]
+#   python benchmarks/golden.py --update     (after an intended change of the outputs, replaces the golden files that differ
+#                                             and adds outputs that have no golden file yet)
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+import main
+
+# name: (folder of the golden outputs, keyword arguments of main.run)
+# single and multi are the settings of single_seq_example.py and multi_seq_example.py; tables writes the numbers their
+# graphs are drawn from (gc, gc12, gc3, gc3s, enc, rscu and codon counts of every sequence), since the perceptual hash
+# alone misses changed values
+examples = {
+    'single': (os.path.join(repo_dir, 'sample_outputs', 'single'),
+               {'single_only': True, 'compare': False, 'multi_only': False}),
+    'multi': (os.path.join(repo_dir, 'sample_outputs', 'multi'),
+              {'single_only': True, 'compare': True, 'multi_only': True,
+               'heatmap_title': 'GAPDH RSCU Across Different Species',
+               'seq_names': ['Homo\nsapiens', 'Drosophila\nmelanogaster', 'Saccharomyces\ncerevisiae', 'Escherichia\ncoli'],
+               'enc_title': 'GAPDH', 'enc_gc3_title': 'GAPDH'}),
+    'tables': (os.path.join(repo_dir, 'benchmarks', 'golden', 'tables'),
+               {'single_only': False, 'compare': False, 'multi_only': False, 'plot_format': None, 'bulk_format': 'tsv'}),
+}
+
+# outputs that are compared, the other files an example writes (timing.json, gc_profiles.u16) are not
+checked_extensions = ('.txt', '.tsv', '.png')
+
+"""
+Splits a line of a text output into its fields, numbers are converted to float
+
+:param str line: one line, fields separated by ':', ',' or white space
+:return: the fields
+:rtype: list
+"""
+def line_fields(line: str):
+    fields = []
+    for field in line.replace(':', ' ').replace(',', ' ').split():
+        try:
+            fields.append(float(field))
+        except ValueError:
+            fields.append(field)
+    return fields
+
+"""
+Compares two text outputs line by line, numbers within a tolerance and everything else exactly
+
+:param str expected_file: golden file
+:param str actual_file: file written by this run
+:param float rtol: relative tolerance of the numbers
+:param float atol: absolute tolerance of the numbers
+:return: what differs, empty if the files match
+:rtype: list
+"""
+def compare_text(expected_file: str, actual_file: str, rtol: float, atol: float):
+    with open(expected_file) as file:
+        expected = [line_fields(line) for line in file if line.strip()]
+    with open(actual_file) as file:
+        actual = [line_fields(line) for line in file if line.strip()]
+    if len(expected) != len(actual):
+        return [f'{len(actual)} lines instead of {len(expected)}']
+    problems = []
+    for n, (old, new) in enumerate(zip(expected, actual), 1):
+        numbers = [isinstance(value, float) for value in old]
+        if len(old) != len(new) or numbers != [isinstance(value, float) for value in new]:
+            problems.append(f'line {n}: {new} instead of {old}')
+        elif not all(o == v for o, v, number in zip(old, new, numbers) if not number):
+            problems.append(f'line {n}: {new} instead of {old}')
+        elif any(numbers) and not np.allclose([v for v in new if isinstance(v, float)],
+                                              [o for o in old if isinstance(o, float)], rtol=rtol, atol=atol,
+                                              equal_nan=True):
+            problems.append(f'line {n}: {new} instead of {old}')
+    return problems
+
+"""
+Perceptual hashes of an image: the average hash (each cell of a hash_size x hash_size grayscale thumbnail brighter
+than the mean or not) and the difference hash (each cell brighter than its right neighbour or not)
+The thumbnail is made by averaging blocks of pixels, so small changes in size, antialiasing or font rendering
+barely change the hashes while a moved, missing or recolored element does
+
+:param str path: image file (png)
+:param int hash_size: thumbnail size, each hash has hash_size**2 bits
+:return: the two hashes as boolean arrays
+:rtype: tuple
+"""
+def image_hashes(path: str, hash_size: int = 16):
+    import matplotlib.image     # matplotlib is only needed for the image checks
+    pixels = matplotlib.image.imread(path).astype(float)
+    if pixels.max() > 1:
+        pixels /= 255   # 8 bit images that were not scaled to 0-1
+    if pixels.ndim == 3:
+        if pixels.shape[2] == 4:
+            # transparent pixels count as white
+            pixels = pixels[:, :, :3] * pixels[:, :, 3:] + (1 - pixels[:, :, 3:])
+        pixels = pixels[:, :, :3] @ [0.299, 0.587, 0.114]
+
+    def thumbnail(width):
+        # mean of each block of rows and columns, the block edges spread evenly over the image
+        rows = np.array_split(np.arange(pixels.shape[0]), hash_size)
+        cols = np.array_split(np.arange(pixels.shape[1]), width)
+        row_means = np.array([pixels[r].mean(axis=0) for r in rows])
+        return np.array([row_means[:, c].mean(axis=1) for c in cols]).T
+
+    small = thumbnail(hash_size)
+    wide = thumbnail(hash_size + 1)
+    return (small > small.mean()).ravel(), (wide[:, 1:] > wide[:, :-1]).ravel()
+
+"""
+Compares two images by the hamming distance of their perceptual hashes (see image_hashes)
+
+:param str expected_file: golden image
+:param str actual_file: image drawn by this run
+:param int max_distance: most hash bits of each hash that may differ
+:return: what differs, empty if the images match
+:rtype: list
+"""
+def compare_image(expected_file: str, actual_file: str, max_distance: int):
+    problems = []
+    for kind, old, new in zip(('average', 'difference'), image_hashes(expected_file), image_hashes(actual_file)):
+        distance = int((old != new).sum())
+        if distance > max_distance:
+            problems.append(f'{kind} hash differs in {distance} of {len(old)} bits')
+    return problems
+
+"""
+Compares every golden output of one example with the output of this run
+
+:param str golden_dir: folder with the golden outputs, it may not exist yet
+:param str output_dir: folder this run wrote to
+:param argparse.Namespace args: tolerances (see the command line options)
+:return: number of files compared, the problems found keyed by file name, and the text and image outputs that have
+         no golden file
+:rtype: tuple
+"""
+def compare_outputs(golden_dir: str, output_dir: str, args):
+    problems = {}
+    names = sorted(name for name in os.listdir(golden_dir) if name.endswith(checked_extensions)) \
+        if os.path.isdir(golden_dir) else []
+    new = sorted(name for name in os.listdir(output_dir) if name.endswith(checked_extensions) and name not in names)
+    for name in names:
+        expected_file = os.path.join(golden_dir, name)
+        actual_file = os.path.join(output_dir, name)
+        if not os.path.exists(actual_file):
+            problems[name] = ['missing']
+        elif name.endswith(('.txt', '.tsv')):
+            problems[name] = compare_text(expected_file, actual_file, args.rtol, args.atol)
+        elif name.endswith('.png'):
+            problems[name] = compare_image(expected_file, actual_file, args.max_hash_distance)
+    return len(names), {name: found for name, found in problems.items() if found}, new
+
+"""
+Runs one example with timing on and returns the seconds of each stage, the fastest of repeat runs
+
+:param dict options: keyword arguments of main.run
+:param str output_dir: folder to write to, the outputs of the last run are left in it
+:param int repeat: number of runs
+:return: seconds per stage, and 'total' for the whole run
+:rtype: dict
+"""
+def run_example(options: dict, output_dir: str, repeat: int):
+    seconds = {}
+    for _ in range(repeat):
+        # the progress output of the example is not part of the report, and every run computes everything
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.run(os.path.join(repo_dir, 'raw_data', 'test.fasta'), output_dir, report_timing=True, use_cache=False,
+                     **options)
+        with open(os.path.join(output_dir, 'timing.json')) as file:
+            timing = json.load(file)
+        run_seconds = {stage: record['seconds'] for stage, record in timing['stages'].items()}
+        run_seconds['total'] = timing['total_seconds']
+        for stage, value in run_seconds.items():
+            seconds[stage] = min(seconds.get(stage, value), value)
+    return seconds
+
+"""
+Compares the stage times of this run with a baseline, a stage fails if it is both max_slowdown (relative) and
+min_seconds (absolute) slower, so the noise of very short stages does not fail the gate
+
+:param dict timings: seconds per stage of each example (see run_example)
+:param dict baseline: the same, recorded earlier
+:param float max_slowdown: allowed relative slowdown, 0.25 for 25 %
+:param float min_seconds: slowdowns shorter than this always pass
+:return: the stages that regressed
+:rtype: list
+"""
+def compare_timings(timings: dict, baseline: dict, max_slowdown: float, min_seconds: float):
+    regressions = []
+    print('\nStage times compared to the baseline (time ratio, > 1 is slower):')
+    for example, stages in timings.items():
+        for stage, seconds in stages.items():
+            old = baseline.get(example, {}).get(stage)
+            if old is None:
+                print(f"  {example:8s} {stage:12s} {seconds:8.3f} s   (not in baseline)")
+                continue
+            ratio = seconds / old if old > 0 else float('inf')
+            slower = seconds > old * (1 + max_slowdown) and seconds - old > min_seconds
+            print(f"  {example:8s} {stage:12s} {seconds:8.3f} s   {ratio:6.2f}x{'   REGRESSED' if slower else ''}")
+            if slower:
+                regressions.append(f'{example} {stage}: {seconds:.3f} s instead of {old:.3f} s')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the example outputs and stage times against recorded ones')
+    parser.add_argument('--rtol', type=float, default=1e-6, help='relative tolerance of numbers in text outputs')
+    parser.add_argument('--atol', type=float, default=1e-4, help='absolute tolerance of numbers in text outputs')
+    parser.add_argument('--max-hash-distance', type=int, default=12,
+                        help='most of the 256 bits of each image hash that may differ')
+    parser.add_argument('--baseline', help='JSON stage times of an earlier run to check against')
+    parser.add_argument('--record-baseline', help='JSON file to save the stage times of this run to')
+    parser.add_argument('--max-slowdown', type=float, default=0.25, help='allowed relative slowdown of a stage')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='slowdowns shorter than this always pass')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per example, the fastest time of each stage is kept')
+    parser.add_argument('--keep', help='folder to keep the outputs of this run in (temporary if not given)')
+    parser.add_argument('--update', action='store_true',
+                        help='replace the golden files that differ with the outputs of this run instead of failing, '
+                             'and add the outputs that have no golden file')
+    args = parser.parse_args()
+
+    failures = []
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for example, (golden_dir, options) in examples.items():
+            output_dir = os.path.join(args.keep or tmp, example)
+            timings[example] = run_example(options, output_dir, args.repeat)
+            n_files, problems, new = compare_outputs(golden_dir, output_dir, args)
+            print(f"{example}: {n_files - len(problems)} of {n_files} outputs match")
+            for name in new:
+                if args.update:
+                    os.makedirs(golden_dir, exist_ok=True)
+                    shutil.copyfile(os.path.join(output_dir, name), os.path.join(golden_dir, name))
+                    print(f"  {name}: golden file added")
+                else:
+                    print(f"  {name}: no golden file, not checked")
+            for name, found in problems.items():
+                for problem in found[:5]:
+                    print(f"  {name}: {problem}")
+                if args.update and found != ['missing']:
+                    shutil.copyfile(os.path.join(output_dir, name), os.path.join(golden_dir, name))
+                    print(f"  {name}: golden file updated")
+                else:
+                    failures.append(f'{example}/{name}')
+
+    if args.record_baseline:
+        with open(args.record_baseline, 'w') as file:
+            json.dump(timings, file, indent=2)
+        print(f"Stage times saved to {args.record_baseline}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            failures.extend(compare_timings(timings, json.load(file), args.max_slowdown, args.min_seconds))
+
+    if failures:
+        print(f"\nFAILED: {len(failures)} check(s)")
+        sys.exit(1)
+    print('\nAll checks passed')
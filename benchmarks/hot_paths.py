@@ -0,0 +1,194 @@
+# times each stage of the analysis on synthetic fasta files: parse, count, derive metrics, render and write
+# run from the repository root:
+#   python benchmarks/hot_paths.py --sizes gene genes_1k --output results.json [--baseline old_results.json]
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis
+from fasta import read_fasta
+
+# name: (number of records, length of each record in bases, whether to render plots)
+# plotting a 50 Mb contig base by base is not meaningful, so the contig set skips the render stage
+sizes = {
+    'gene': (1, 1_000, True),
+    'genes_1k': (1_000, 1_000, True),
+    'genes_100k': (100_000, 1_000, True),
+    'contig_50mb': (1, 50_000_000, False),
+}
+
+"""
+Writes a fasta file of random sequences, the same seed always gives the same file
+
+:param str path: file to write
+:param int n_records: number of sequences
+:param int length: length of each sequence
+:param int seed: random seed
+"""
+def write_synthetic_fasta(path: str, n_records: int, length: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+    with open(path, 'wb', buffering=1024**2) as fa:
+        for i in range(n_records):
+            seq = bases[rng.integers(0, 4, length)]
+            fa.write(f'>seq{i}\n'.encode())
+            # 70 bases per line like most fasta files
+            for start in range(0, length, 70):
+                fa.write(seq[start:start+70].tobytes() + b'\n')
+
+"""
+Resets the peak resident memory of this process to its current resident memory, so the next peak_rss_mb is the peak
+of the stage that runs in between (linux only, through /proc/self/clear_refs)
+
+:return: True if the peak was reset, False if this system can not reset it
+:rtype: bool
+"""
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+"""
+Returns the peak resident memory of this process since the last reset_peak_rss, or since it started if the peak
+can not be reset
+
+:return: peak RSS in MB
+:rtype: float
+"""
+def peak_rss_mb():
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+"""
+Runs one stage and records its wall time, throughput and the peak RSS while it ran (peak_rss_mb); where the peak can not
+be reset (see reset_peak_rss) only the peak of the whole process so far is known, it is recorded as process_peak_rss_mb
+
+:param dict results: stage results, updated in place
+:param str stage: name of the stage
+:param int n_bases: bases processed by the stage, for the throughput
+:param func: function to time
+:return: what func returns
+"""
+def timed(results: dict, stage: str, n_bases: int, func):
+    per_stage = reset_peak_rss()
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    peak_key = 'peak_rss_mb' if per_stage else 'process_peak_rss_mb'
+    results[stage] = {
+        'seconds': seconds,
+        'bases_per_sec': n_bases / seconds if seconds > 0 else None,
+        peak_key: peak_rss_mb(),
+    }
+    label = 'peak RSS' if per_stage else 'process peak RSS so far'
+    print(f"  {stage:8s} {seconds:9.3f} s  {n_bases / max(seconds, 1e-9):14.0f} bases/s  "
+          f"{label} {results[stage][peak_key]:8.1f} MB")
+    return value
+
+"""
+Benchmarks every stage on one synthetic fasta file
+
+:param str fasta_file: fasta file to analyze
+:param int n_bases: total bases in the file
+:param bool render: True to time rendering plots
+:param str output_dir: folder for the render and write stages
+:return: results of each stage
+:rtype: dict
+"""
+def run_size(fasta_file: str, n_bases: int, render: bool, output_dir: str):
+    results = {}
+    timed(results, 'parse_biopython', n_bases, lambda: list(read_fasta(fasta_file, 'biopython')))
+    records = timed(results, 'parse', n_bases, lambda: list(read_fasta(fasta_file)))
+    names = [name for name, _ in records]
+    seqs = [seq for _, seq in records]
+
+    counts = timed(results, 'count', n_bases, lambda: analysis.codon_count_matrix(seqs))
+
+    def derive():
+        analysis.amino_acid_counts(counts)
+        analysis.rscu_values(counts)
+        analysis.enc_values(counts)
+        analysis.gc3_values(counts)
+        return [analysis.gc_profile(seq, 30) for seq in seqs]
+    profiles = timed(results, 'derive', n_bases, derive)
+
+    if render:
+        def render_plots():
+            import plotting
+            # per sequence plots of the first sequence, and the comparison heatmap of all of them
+            plotting.rscu(analysis.rscu(counts[0], analysis.amino_acid_counts(counts[0])),
+                          os.path.join(output_dir, 'rscu.png'))
+            plotting.gc_distribution(profiles[0], len(seqs[0]), os.path.join(output_dir, 'gc_dist.png'))
+            plotting.rscu_heatmap(names, counts, '', os.path.join(output_dir, 'heatmap.png'), max_rows=100)
+        timed(results, 'render', len(seqs[0]), render_plots)
+
+    def write():
+        from bulk_output import BulkWriter
+        writer = BulkWriter(output_dir, 'tsv', 30)
+        for name, seq, count, profile in zip(names, seqs, counts, profiles):
+            gc12, gc3 = analysis.gc_codon_positions(seq)
+            writer.add(name, {'codon_counts': count, 'gc': analysis.gc(seq), 'gc12': gc12, 'gc3': gc3,
+                              'gc_profile': profile, 'length': len(seq)})
+        writer.close()
+    timed(results, 'write', n_bases, write)
+    return results
+
+"""
+Prints how much slower or faster each stage is than in a baseline results file
+
+:param dict results: results of this run
+:param dict baseline: results loaded from an earlier run
+"""
+def compare(results: dict, baseline: dict):
+    print('\nCompared to baseline (time ratio, > 1 is slower):')
+    for size, stages in results['sizes'].items():
+        for stage, values in stages.items():
+            old = baseline.get('sizes', {}).get(size, {}).get(stage)
+            if old:
+                print(f"  {size:12s} {stage:8s} {values['seconds'] / old['seconds']:6.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the analysis and plotting hot paths')
+    parser.add_argument('--sizes', nargs='+', default=['gene', 'genes_1k'], choices=list(sizes),
+                        help='synthetic data sets to run')
+    parser.add_argument('--data-dir', help='folder to keep the synthetic fasta files in (temporary if not given)')
+    parser.add_argument('--output', help='JSON file to save the results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        results = {'python': sys.version, 'numpy': np.__version__, 'sizes': {}}
+        for size in args.sizes:
+            n_records, length, render = sizes[size]
+            fasta_file = os.path.join(data_dir, f'{size}.fasta')
+            if not os.path.exists(fasta_file):
+                write_synthetic_fasta(fasta_file, n_records, length)
+            print(f"{size}: {n_records} x {length} bases")
+            output_dir = os.path.join(tmp, size)
+            os.makedirs(output_dir)
+            results['sizes'][size] = run_size(fasta_file, n_records * length, render, output_dir)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
@@ -0,0 +1,52 @@
+# measures how long a fresh python process takes to import the analysis modules
+# run from the repository root: python benchmarks/startup.py [--repeat N] [--output results.json]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: code run in a new interpreter
+cases = {
+    'interpreter': 'pass',
+    'analysis': 'import analysis',
+    'stats_only_pipeline': 'import main',
+    'full_pipeline': 'import main, plotting, seaborn, pandas',
+}
+
+"""
+Times one import in fresh interpreters, so nothing is already cached in sys.modules
+
+:param str code: python code to run
+:param int repeat: number of interpreters to start
+:return: wall time of each run in seconds
+:rtype: list
+"""
+def time_cold_import(code: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=repo_dir, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold import time of the analysis modules')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters per case')
+    parser.add_argument('--output', help='JSON file to save the results to')
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in cases.items():
+        times = time_cold_import(code, args.repeat)
+        results[name] = {'code': code, 'min_s': min(times), 'median_s': statistics.median(times)}
+        print(f"{name:22s} min {min(times) * 1000:7.1f} ms   median {statistics.median(times) * 1000:7.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'python': sys.version, 'results': results}, file, indent=2)
+        print(f"Results saved to {args.output}")
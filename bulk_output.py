@@ -0,0 +1,146 @@
+# writes the statistics of all sequences into a few large files instead of several small files per sequence
+import json
+import os
+import numpy as np
+import analysis
+
+summary_columns = ['name', 'length', 'codons', 'invalid_codons', 'gc', 'gc12', 'gc3', 'gc3s', 'enc']
+
+"""
+Writes one codon count matrix, one RSCU matrix and one summary table (a row per sequence in each),
+plus the GC distributions of all sequences in one array file that can be memory mapped with load_gc_profiles
+
+Output files in the output folder:
+    codon_counts.<fmt>   name + 64 codon counts
+    rscu.<fmt>           name + 64 rscu values
+    summary.<fmt>        name, length, codons, invalid_codons, gc, gc12, gc3, gc3s, enc
+    gc_profiles.u16      g/c count of every window of every sequence, uint16, back to back
+    gc_profiles.json     window size and where each sequence's windows start in gc_profiles.u16
+"""
+class BulkWriter:
+    """
+    :param str output_dir: folder to write the files to
+    :param str fmt: 'tsv' or 'parquet' (needs pyarrow)
+    :param int window_size: window size the GC distributions were computed with
+    :param int batch_size: rows buffered before they are written (parquet row group size)
+    :param GeneticCode code: genetic code to compute RSCU, GC3s and ENC with (see genetic_codes), None for the standard code
+    :param str enc_method: 'wright' or 'novembre', see analysis.enc_values
+    """
+    def __init__(self, output_dir: str, fmt: str = 'tsv', window_size: int = 30, batch_size: int = 10000, code=None,
+                 enc_method: str = 'wright'):
+        if fmt not in ('tsv', 'parquet'):
+            raise ValueError(f"fmt must be 'tsv' or 'parquet', not {fmt!r}")
+        if fmt == 'parquet':
+            # optional dependency, only needed for this format
+            import pyarrow
+            import pyarrow.parquet
+            self.pa = pyarrow
+            self.pq = pyarrow.parquet
+
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.window_size = window_size
+        self.batch_size = batch_size
+        self.code = code
+        self.enc_method = enc_method
+
+        self.tables = {
+            'codon_counts': ['name'] + analysis.codon_list,
+            'rscu': ['name'] + analysis.codon_list,
+            'summary': summary_columns,
+        }
+        self.paths = {table: os.path.join(output_dir, f'{table}.{fmt}') for table in self.tables}
+        self.rows = {table: [] for table in self.tables}
+        self.files = {}
+        for table, columns in self.tables.items():
+            if fmt == 'tsv':
+                self.files[table] = open(self.paths[table], 'w', buffering=1024**2)
+                self.files[table].write('\t'.join(columns) + '\n')
+            else:
+                self.files[table] = None    # created with the schema of the first batch
+
+        self.gc_file = open(os.path.join(output_dir, 'gc_profiles.u16'), 'wb', buffering=1024**2)
+        self.gc_offsets = [0]
+        self.names = []
+
+    """
+    Adds the statistics of one sequence
+
+    :param str name: name of the sequence
+    :param dict stats: statistics of the sequence (see main.sequence_stats or genome.MappedFasta.stats), plus its length
+    """
+    def add(self, name: str, stats: dict):
+        counts = stats['codon_counts']
+        self.rows['codon_counts'].append([name] + counts.tolist())
+        self.rows['rscu'].append([name] + analysis.rscu_values(counts, code=self.code).tolist())
+        self.rows['summary'].append([name, stats['length'], int(counts.sum()), stats.get('invalid_codons', 0),
+                                     stats['gc'], stats['gc12'], stats['gc3'], float(analysis.gc3s_values(counts, self.code)),
+                                     analysis.enc(counts, self.code, self.enc_method)])
+
+        if stats['gc_profile'] is not None:
+            # percentages are k / window_size * 100 rounded to 4 decimals, so the g/c count k can be recovered exactly
+            window_counts = np.rint(np.asarray(stats['gc_profile']) * self.window_size / 100).astype(np.uint16)
+        else:
+            # whole genome mode (see genome.MappedFasta.stats), the counts are an array or a uint16 file
+            window_counts = stats['gc_window_counts']
+            if isinstance(window_counts, str):
+                window_counts = np.memmap(window_counts, dtype=np.uint16, mode='r') \
+                    if os.path.getsize(window_counts) else np.zeros(0, dtype=np.uint16)
+        # in slices, so a memory mapped chromosome's windows are not read into memory at once
+        for start in range(0, len(window_counts), 1024**2):
+            self.gc_file.write(np.asarray(window_counts[start:start + 1024**2], dtype=np.uint16).tobytes())
+        self.gc_offsets.append(self.gc_offsets[-1] + len(window_counts))
+        self.names.append(name)
+
+        if len(self.rows['summary']) >= self.batch_size:
+            self.flush()
+
+    """
+    Writes the buffered rows
+    """
+    def flush(self):
+        for table, rows in self.rows.items():
+            if not rows:
+                continue
+            if self.fmt == 'tsv':
+                self.files[table].write(''.join('\t'.join(map(str, row)) + '\n' for row in rows))
+            else:
+                columns = self.tables[table]
+                batch = self.pa.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+                if self.files[table] is None:
+                    self.files[table] = self.pq.ParquetWriter(self.paths[table], batch.schema)
+                self.files[table].write_table(batch)
+            rows.clear()
+
+    """
+    Writes the remaining rows and the GC distribution index, and closes all files
+    """
+    def close(self):
+        self.flush()
+        for table, file in self.files.items():
+            if file is not None:
+                file.close()
+        self.gc_file.close()
+        with open(os.path.join(self.output_dir, 'gc_profiles.json'), 'w') as file:
+            json.dump({'window_size': self.window_size, 'dtype': 'uint16',
+                       'names': self.names, 'offsets': self.gc_offsets}, file)
+        for path in self.paths.values():
+            print(f"Table saved to {path}")
+
+"""
+Opens the GC distributions written by BulkWriter without reading them into memory
+
+:param str output_dir: folder the files were written to
+:return: (window g/c counts as a memory mapped array, names, offsets, window size)
+         the windows of sequence i are counts[offsets[i]:offsets[i+1]], see analysis.gc_window_percent
+:rtype: tuple
+"""
+def load_gc_profiles(output_dir: str):
+    with open(os.path.join(output_dir, 'gc_profiles.json')) as file:
+        index = json.load(file)
+    path = os.path.join(output_dir, 'gc_profiles.u16')
+    if os.path.getsize(path) == 0:
+        counts = np.zeros(0, dtype=np.uint16)   # numpy cannot memory map an empty file
+    else:
+        counts = np.memmap(path, dtype=np.uint16, mode='r')
+    return counts, index['names'], np.array(index['offsets']), index['window_size']
@@ -0,0 +1,168 @@
+# on-disk cache of per sequence statistics, so sequences that were already analyzed are not recomputed
+import hashlib
+import os
+import sqlite3
+import time
+from multiprocessing.util import Finalize
+import numpy as np
+
+# open caches of this process, keys are file paths
+open_caches = {}
+
+"""
+Computes the cache key of a sequence: a hash of the sequence and of every parameter its statistics depend on
+
+:param seq: the sequence, as a str or bytes
+:param params: analysis parameters, for example window_size=30
+:return: hex digest
+:rtype: str
+"""
+def cache_key(seq, **params):
+    if isinstance(seq, str):
+        seq = seq.encode()
+    h = hashlib.sha256(seq)
+    h.update(repr(sorted(params.items())).encode())
+    return h.hexdigest()
+
+"""
+SQLite file holding the codon counts and GC content of previously analyzed sequences, a few hundred bytes each
+whatever the sequence length (the gc distribution is recomputed instead of stored)
+The total size of the stored statistics is kept in a one row meta table, updated in the same transaction as each
+write, so checking the size limit does not scan the table. When it grows past max_bytes, the least recently used
+entries are removed in one batch until it is under low_water * max_bytes
+Cache hits are not written back one by one: their last used times are collected and stored touch_batch at a time,
+with the next put, or when the cache is flushed (see flush_caches)
+"""
+class StatsCache:
+    """
+    :param str path: cache file, created if it does not exist
+    :param int max_bytes: size limit for the stored statistics
+    :param float low_water: fraction of max_bytes the eviction brings the cache down to
+    :param int touch_batch: number of cache hits whose last used time is kept in memory before being stored
+    """
+    def __init__(self, path: str, max_bytes: int = 1024**3, low_water: float = 0.9, touch_batch: int = 1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.touch_batch = touch_batch
+        self.touched = {}   # key: last used time, for hits not stored yet
+        # several worker processes can share the file, wait for each other's writes instead of failing
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            # files written by older versions also stored the gc profile of every sequence, they are emptied
+            if self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'stats' AND sql LIKE '%gc_profile%'").fetchone():
+                self.db.execute('DROP TABLE stats')
+                self.db.execute('DROP TABLE IF EXISTS meta')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS stats (
+                                   key TEXT PRIMARY KEY,
+                                   codon_counts BLOB,
+                                   gc REAL,
+                                   gc12 REAL,
+                                   gc3 REAL,
+                                   size INTEGER,
+                                   last_used REAL)''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS stats_last_used ON stats (last_used)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER)')
+            self.db.execute('INSERT OR IGNORE INTO meta VALUES (0, 0)')
+
+    """
+    Looks up the statistics stored under a key and marks them as recently used
+
+    :param str key: see cache_key
+    :return: dict with codon_counts, invalid_codons, gc, gc12 and gc3, or None if the key is not stored
+    :rtype: dict
+    """
+    def get(self, key: str):
+        row = self.db.execute('SELECT codon_counts, gc, gc12, gc3 FROM stats WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.touch_batch:
+            with self.db:
+                self.store_touched()
+        counts, gc, gc12, gc3 = row
+        # the number of invalid codons is stored after the 64 codon counts
+        counts = np.frombuffer(counts, dtype=np.int64)
+        return {
+            'codon_counts': counts[:64],
+            'invalid_codons': int(counts[64]),
+            'gc': gc,
+            'gc12': gc12,
+            'gc3': gc3,
+        }
+
+    """
+    Writes the last used times of the collected cache hits, inside the caller's transaction
+    """
+    def store_touched(self):
+        if self.touched:
+            self.db.executemany('UPDATE stats SET last_used = ? WHERE key = ?',
+                                [(used, key) for key, used in self.touched.items()])
+            self.touched = {}
+
+    """
+    Stores statistics under a key, then removes least recently used entries if the cache is over its size limit
+
+    :param str key: see cache_key
+    :param dict stats: codon_counts, invalid_codons, gc, gc12 and gc3 (same as returned by get), other items are not
+                       stored
+    """
+    def put(self, key: str, stats: dict):
+        counts = np.append(np.asarray(stats['codon_counts'], dtype=np.int64), stats.get('invalid_codons', 0)).tobytes()
+        size = len(counts) + len(key)
+        with self.db:
+            # writes first, so the transaction holds the write lock from its first statement
+            self.db.execute('UPDATE meta SET total_bytes = total_bytes - COALESCE((SELECT size FROM stats WHERE key = ?), 0) '
+                            '+ ?', (key, size))
+            self.db.execute('INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (key, counts, stats['gc'], stats['gc12'], stats['gc3'], size, time.time()))
+            self.store_touched()
+            total = self.db.execute('SELECT total_bytes FROM meta').fetchone()[0]
+            if total > self.max_bytes:
+                # walk from the oldest entry and drop entries until the cache is under the low water mark
+                excess = total - int(self.low_water * self.max_bytes)
+                freed = 0
+                old_keys = []
+                for old_key, old_size in self.db.execute('SELECT key, size FROM stats ORDER BY last_used'):
+                    if freed >= excess:
+                        break
+                    if old_key != key:
+                        old_keys.append((old_key,))
+                        freed += old_size
+                self.db.executemany('DELETE FROM stats WHERE key = ?', old_keys)
+                self.db.execute('UPDATE meta SET total_bytes = total_bytes - ?', (freed,))
+
+    """
+    Stores the last used times of the cache hits collected so far
+    """
+    def flush(self):
+        with self.db:
+            self.store_touched()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+"""
+Returns the cache for a file, opening it the first time it is used in this process
+
+:param str path: cache file
+:param int max_bytes: size limit for the stored statistics
+:return: the cache
+:rtype: StatsCache
+"""
+def get_cache(path: str, max_bytes: int = 1024**3):
+    path = os.path.abspath(path)
+    if path not in open_caches:
+        if not open_caches:
+            # also runs when a worker process of a pool exits, where atexit handlers do not
+            Finalize(None, flush_caches, exitpriority=10)
+        open_caches[path] = StatsCache(path, max_bytes)
+    return open_caches[path]
+
+"""
+Stores the collected cache hits of every cache open in this process (see StatsCache)
+"""
+def flush_caches():
+    for stats_cache in open_caches.values():
+        stats_cache.flush()
@@ -0,0 +1,139 @@
+# codon pair (dicodon) usage: counts of the 64 x 64 = 4096 pairs of adjacent codons in one dense counter, codon pair
+# scores (CPS) of a reference gene set and codon pair bias (CPB) of any number of genes (Coleman et al. 2008)
+# pair slot = 64 * slot of the first codon + slot of the second codon (see analysis.codon_list)
+import json
+import numpy as np
+import analysis
+from genetic_codes import get_genetic_code
+
+# names of the pair slots, for example 'GCC-AAG'
+pair_list = [first + '-' + second for first in analysis.codon_list for second in analysis.codon_list]
+
+"""
+Converts codon slots to pair slots, one per pair of adjacent codons
+Pairs that contain a codon with an invalid base are left out
+
+:param slots: codon slots in reading order (see analysis.codon_indices, windows.sequence_codon_slots)
+:return: pair slots, values 0-4095
+:rtype: numpy.ndarray
+"""
+def pair_indices(slots):
+    slots = np.asarray(slots, dtype=np.intp)
+    pairs = slots[:-1] * 64 + slots[1:]
+    return pairs[(slots[:-1] < 64) & (slots[1:] < 64)]
+
+"""
+Counts each pair of adjacent codons in one vectorized pass
+
+:param sequence: the sequence (str or bytes, read from its first base), or its codon slots as an integer array
+:return: 4096 counts, index i is the count of pair_list[i]
+:rtype: numpy.ndarray
+"""
+def pair_counts(sequence):
+    slots = analysis.codon_indices(sequence) if isinstance(sequence, (str, bytes)) else sequence
+    return np.bincount(pair_indices(slots), minlength=4096)
+
+"""
+Counts the codon pairs of many sequences into one matrix
+
+:param sequences: iterable of sequences or codon slot arrays (see pair_counts)
+:return: N x 4096 pair count matrix, one row per sequence
+:rtype: numpy.ndarray
+"""
+def pair_count_matrix(sequences):
+    rows = [pair_counts(sequence) for sequence in sequences]
+    return np.vstack(rows) if rows else np.zeros((0, 4096), dtype=np.int64)
+
+"""
+Codon pair scores of a reference gene set
+CPS = ln(observed pair count / expected pair count), the expected count assumes the two codons are chosen
+independently of each other given the two amino acids: N_A * N_B / (N_X * N_Y) * N_XY
+for codons A, B coding for amino acids X, Y
+"""
+class PairTable:
+    """
+    :param cps: 4096 codon pair scores ordered like pair_list (0 for pairs that are not scored)
+    :param scored: 4096 booleans, True for the pairs that count towards the codon pair bias
+    :param int genetic_code: NCBI table number the scores were built for
+    :param dict info: anything else worth keeping with the table
+    """
+    def __init__(self, cps, scored, genetic_code: int = 1, info=None):
+        self.cps = np.asarray(cps, dtype=float)
+        self.scored = np.asarray(scored, dtype=bool)
+        self.genetic_code = genetic_code
+        self.info = info or {}
+
+    """
+    Computes the codon pair bias (mean CPS of the scored pairs) of one sequence or every row of a matrix in one pass
+
+    :param pair_data: 4096 pair counts or an N x 4096 matrix (see pair_counts, pair_count_matrix)
+    :return: the CPB of each row, nan for rows without scored pairs
+    :rtype: float or numpy.ndarray
+    """
+    def score(self, pair_data):
+        counts = np.asarray(pair_data)
+        n_scored = counts @ self.scored
+        total = counts @ self.cps
+        return np.divide(total, n_scored, out=np.full(np.shape(n_scored), np.nan), where=n_scored != 0)
+
+    """
+    Saves the table as JSON
+
+    :param str path: file to write
+    """
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            json.dump({
+                'kind': 'cps',
+                'genetic_code': self.genetic_code,
+                'cps': {pair: float(cps) for pair, cps, scored in zip(pair_list, self.cps, self.scored) if scored},
+                'info': self.info,
+            }, file, indent=2)
+
+"""
+Loads a table saved with PairTable.save
+
+:param str path: JSON file
+:return: the table
+:rtype: PairTable
+"""
+def load_pair_table(path: str):
+    with open(path) as file:
+        data = json.load(file)
+    if data.get('kind') != 'cps':
+        raise ValueError(f"{path} does not hold codon pair scores")
+    scored = np.array([pair in data['cps'] for pair in pair_list])
+    cps = np.array([data['cps'].get(pair, 0.0) for pair in pair_list])
+    return PairTable(cps, scored, data.get('genetic_code', 1), data.get('info'))
+
+"""
+Builds codon pair scores from the pair and codon counts of a reference gene set
+Pairs with a stop codon and pairs never seen in the reference are not scored
+
+:param reference_pairs: 4096 pair counts, or an N x 4096 matrix (rows are summed)
+:param reference_codons: 64 codon counts of the same genes, or an N x 64 matrix (rows are summed)
+:param code: NCBI table number or compiled genetic code (see genetic_codes)
+:return: the scores
+:rtype: PairTable
+"""
+def pair_table(reference_pairs, reference_codons, code=1):
+    code = get_genetic_code(code)
+    pairs = np.asarray(reference_pairs, dtype=float)
+    codons = analysis.as_codon_array(reference_codons).astype(float)
+    if pairs.ndim > 1:
+        pairs = pairs.sum(axis=0)
+    if codons.ndim > 1:
+        codons = codons.sum(axis=0)
+
+    amino_acids = codons @ code.codon_aa_matrix
+    # amino acid pair counts: n_amino_acids x n_amino_acids
+    aa_pairs = code.codon_aa_matrix.T @ pairs.reshape(64, 64) @ code.codon_aa_matrix
+    aa = code.codon_aa_index
+    codon_share = np.divide(codons, amino_acids[aa], out=np.zeros(64), where=amino_acids[aa] != 0)
+    expected = np.outer(codon_share, codon_share) * aa_pairs[aa[:, None], aa[None, :]]
+
+    stop = code.stop_mask[:64]
+    scored = ((pairs.reshape(64, 64) > 0) & (expected > 0) & ~stop[:, None] & ~stop[None, :]).ravel()
+    cps = np.zeros(4096)
+    cps[scored] = np.log(pairs[scored] / expected.ravel()[scored])
+    return PairTable(cps, scored, code.table_id, {'reference_pairs': int(pairs.sum())})
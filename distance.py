@@ -0,0 +1,260 @@
+# codon usage structure of many sequences: pairwise distances between their codon usage profiles (computed in blocks of
+# rows so memory stays bounded), hierarchical clustering, and principal component / correspondence analysis
+import numpy as np
+import analysis
+
+metrics = ('euclidean', 'cosine', 'chi-square', 'jensen-shannon')
+# largest N x N working copy linkage makes (O(N^2) memory), 4 GB is about 32000 rows of float32 distances
+linkage_max_bytes = 4 * 1024**3
+
+"""
+Converts codon counts to the profiles the distances are computed between
+
+:param codon_counts: N x 64 codon count matrix (see analysis.codon_count_matrix)
+:param str kind: 'rscu' for the RSCU of each codon (see analysis.rscu_values), 'frequency' for the fraction of
+                 all codons of the sequence
+:param GeneticCode code: genetic code to group synonymous codons by (see genetic_codes), None for the standard code
+:return: N x 64 profiles
+:rtype: numpy.ndarray
+"""
+def codon_profiles(codon_counts, kind: str = 'rscu', code=None):
+    counts = np.asarray(codon_counts, dtype=float)
+    if kind == 'rscu':
+        return analysis.rscu_values(counts, code=code)
+    if kind == 'frequency':
+        totals = counts.sum(axis=1, keepdims=True)
+        return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals != 0)
+    raise ValueError(f"kind must be 'rscu' or 'frequency', not {kind!r}")
+
+"""
+Computes the distances from some rows of the profiles to all rows
+
+:param numpy.ndarray block: B x M profiles
+:param numpy.ndarray data: N x M profiles
+:param str metric: see distance_matrix
+:param dict norms: per row values of data that every block needs, computed once (see distance_matrix)
+:return: B x N distances
+:rtype: numpy.ndarray
+"""
+def block_distances(block, data, metric: str, norms: dict):
+    if metric == 'euclidean':
+        squared = (block**2).sum(axis=1)[:, None] - 2 * block @ data.T + norms['squared'][None, :]
+        return np.sqrt(np.maximum(squared, 0))
+    if metric == 'cosine':
+        lengths = np.sqrt((block**2).sum(axis=1))[:, None] * norms['length'][None, :]
+        similarity = np.divide(block @ data.T, lengths, out=np.zeros(lengths.shape), where=lengths != 0)
+        return np.maximum(1 - similarity, 0)
+
+    # the other metrics compare profiles as distributions, B x N x M at a time
+    p = block / np.maximum(block.sum(axis=1, keepdims=True), 1e-300)
+    q = norms['distribution']
+    p, q = p[:, None, :], q[None, :, :]
+    if metric == 'chi-square':
+        total = p + q
+        return 0.5 * np.divide((p - q)**2, total, out=np.zeros(np.broadcast(p, q).shape), where=total != 0).sum(axis=2)
+    # jensen-shannon distance (square root of the divergence, base 2 logarithms so it is at most 1)
+    m = (p + q) / 2
+    kl_p = np.where(p > 0, p * np.log2(np.divide(p, m, out=np.ones(np.broadcast(p, m).shape), where=p > 0)), 0)
+    kl_q = np.where(q > 0, q * np.log2(np.divide(q, m, out=np.ones(np.broadcast(q, m).shape), where=q > 0)), 0)
+    return np.sqrt(np.maximum((kl_p.sum(axis=2) + kl_q.sum(axis=2)) / 2, 0))
+
+"""
+Computes the N x N distance matrix between the rows of the profiles, block_rows rows at a time
+'euclidean' and 'cosine' are matrix products; 'chi-square' (symmetric, 1/2 sum (p - q)^2 / (p + q)) and
+'jensen-shannon' compare the rows scaled to sum to 1 and need block x N x 64 values at a time, so their blocks are
+made smaller to stay under max_block_bytes
+
+:param data: N x M profiles (see codon_profiles)
+:param str metric: 'euclidean', 'cosine', 'chi-square' or 'jensen-shannon'
+:param out: array to write the distances to (for example a numpy.memmap), a new float32 array if None
+:param int max_block_bytes: about how much memory each block may use
+:return: the distances
+:rtype: numpy.ndarray
+"""
+def distance_matrix(data, metric: str = 'euclidean', out=None, max_block_bytes: int = 256 * 1024**2):
+    if metric not in metrics:
+        raise ValueError(f"metric must be one of {metrics}, not {metric!r}")
+    data = np.asarray(data, dtype=float)
+    n = len(data)
+    if out is None:
+        out = np.zeros((n, n), dtype=np.float32)
+
+    norms = {'squared': (data**2).sum(axis=1)}
+    norms['length'] = np.sqrt(norms['squared'])
+    norms['distribution'] = data / np.maximum(data.sum(axis=1, keepdims=True), 1e-300)
+    # bytes per block row: a few N x M arrays for the distribution metrics, a few N vectors for the others
+    row_bytes = 8 * n * (6 * data.shape[1] if metric in ('chi-square', 'jensen-shannon') else 4)
+    block_rows = max(1, min(n, max_block_bytes // max(row_bytes, 1)))
+    for start in range(0, n, block_rows):
+        out[start:start + block_rows] = block_distances(data[start:start + block_rows], data, metric, norms)
+    # exactly 0 to itself, whatever the rounding of the matrix products
+    out[np.arange(n), np.arange(n)] = 0
+    return out
+
+"""
+Agglomerative hierarchical clustering of a distance matrix with the nearest neighbor chain algorithm
+(O(N^2) time, one N x N working copy of the distances in their own precision, so float32 distances take 4 N^2 bytes)
+The working copy is held in memory, so a matrix that would need more than max_bytes is refused with a ValueError
+
+:param distances: N x N distance matrix (see distance_matrix), for example a numpy.memmap
+:param str method: 'average', 'complete' or 'single' linkage
+:param int max_bytes: largest working copy to make
+:param bool overwrite: True to use distances itself as the working copy (an in-memory matrix made only to be
+                       clustered), it is overwritten
+:return: (N - 1) x 4 linkage matrix in the same layout as scipy.cluster.hierarchy.linkage: the two clusters merged
+         (0..N-1 are the rows, N + i is the cluster made by merge i), their distance and the size of the new cluster
+:rtype: numpy.ndarray
+"""
+def linkage(distances, method: str = 'average', max_bytes: int = linkage_max_bytes, overwrite: bool = False):
+    if method not in ('average', 'complete', 'single'):
+        raise ValueError(f"method must be 'average', 'complete' or 'single', not {method!r}")
+    distances = np.asarray(distances)
+    dtype = np.float32 if distances.dtype == np.float32 else np.float64
+    n = len(distances)
+    if not overwrite and n * n * np.dtype(dtype).itemsize > max_bytes:
+        raise ValueError(f"clustering {n} rows needs {n * n * np.dtype(dtype).itemsize // 1024**2} MB of memory, "
+                         f"more than max_bytes ({max_bytes // 1024**2} MB)")
+    D = distances if overwrite else np.array(distances, dtype=dtype)
+    if n < 2:
+        return np.zeros((0, 4))
+    np.fill_diagonal(D, np.inf)
+    sizes = np.ones(n)
+    active = np.ones(n, dtype=bool)
+    merges = []     # (distance, row standing for cluster a, row standing for cluster b)
+    chain = []
+    remaining = n
+    while remaining > 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))    # any cluster that is still active
+        a = chain[-1]
+        b = int(np.argmin(D[a]))
+        if len(chain) > 1 and D[a, chain[-2]] == D[a, b]:
+            b = chain[-2]   # ties go to the previous cluster of the chain, so the chain always ends
+        if len(chain) > 1 and b == chain[-2]:
+            chain.pop()
+            chain.pop()
+            merges.append((D[a, b], a, b))
+            # Lance-Williams update, the merged cluster is stored in row a and row b is removed
+            if method == 'average':
+                merged = (sizes[a] * D[a] + sizes[b] * D[b]) / (sizes[a] + sizes[b])
+            elif method == 'complete':
+                merged = np.maximum(D[a], D[b])
+            else:
+                merged = np.minimum(D[a], D[b])
+            D[a] = merged
+            D[:, a] = merged
+            D[b] = np.inf
+            D[:, b] = np.inf
+            D[a, a] = np.inf
+            sizes[a] += sizes[b]
+            active[b] = False
+            remaining -= 1
+        else:
+            chain.append(b)
+
+    # merges in order of distance, numbered like scipy (the chain finds them out of order)
+    merges.sort(key=lambda merge: merge[0])
+    parent = list(range(n))
+    cluster_of = list(range(n))     # cluster number of each union-find root
+    size_of = [1] * n
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    result = np.zeros((n - 1, 4))
+    for i, (dist, a, b) in enumerate(merges):
+        ra, rb = root(a), root(b)
+        first, second = sorted((cluster_of[ra], cluster_of[rb]))
+        result[i] = first, second, dist, size_of[ra] + size_of[rb]
+        parent[rb] = ra
+        cluster_of[ra] = n + i
+        size_of[ra] += size_of[rb]
+    return result
+
+"""
+Orders the rows like the leaves of the dendrogram of a linkage, so similar rows end up next to each other
+
+:param numpy.ndarray links: linkage matrix (see linkage)
+:return: row indices in leaf order
+:rtype: numpy.ndarray
+"""
+def leaf_order(links):
+    n = len(links) + 1
+    order = []
+    stack = [2 * n - 2] if len(links) else [0]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            order.append(node)
+        else:
+            left, right = links[node - n, :2].astype(int)
+            stack.extend((right, left))     # left is visited first
+    return np.array(order, dtype=np.intp)
+
+"""
+Orders rows by hierarchical clustering of their profiles (see distance_matrix, linkage)
+The float32 distance matrix is clustered in place, so the memory used is 4 N^2 bytes, refused past max_bytes
+
+:param data: N x M profiles
+:param str metric: distance metric, see distance_matrix
+:param str method: linkage method, see linkage
+:param int max_bytes: largest distance matrix to make
+:return: row indices, similar rows next to each other
+:rtype: numpy.ndarray
+"""
+def cluster_order(data, metric: str = 'euclidean', method: str = 'average', max_bytes: int = linkage_max_bytes):
+    if len(data)**2 * 4 > max_bytes:
+        raise ValueError(f"clustering {len(data)} rows needs {len(data)**2 * 4 // 1024**2} MB of memory, "
+                         f"more than max_bytes ({max_bytes // 1024**2} MB)")
+    return leaf_order(linkage(distance_matrix(data, metric), method, overwrite=True))
+
+"""
+Principal component analysis of codon usage profiles
+
+:param data: N x M profiles (see codon_profiles)
+:param int n_components: number of components to return
+:return: (scores, explained), N x n_components coordinates of the rows and the fraction of the variance
+         explained by each component
+:rtype: tuple
+"""
+def pca(data, n_components: int = 2):
+    data = np.asarray(data, dtype=float)
+    centered = data - data.mean(axis=0)
+    u, s, _ = np.linalg.svd(centered, full_matrices=False)
+    variance = s**2
+    explained = variance / variance.sum() if variance.sum() > 0 else variance
+    k = min(n_components, len(s))
+    return u[:, :k] * s[:k], explained[:k]
+
+"""
+Correspondence analysis of a codon count matrix (the usual ordination of codon usage tables)
+Codons that no sequence uses and sequences without codons are left out of the analysis and get coordinates 0
+
+:param codon_counts: N x 64 codon count matrix (see analysis.codon_count_matrix)
+:param int n_components: number of axes to return
+:return: (row coordinates, codon coordinates, explained), principal coordinates of the sequences (N x k) and of the
+         codons (64 x k), and the fraction of the total inertia on each axis
+:rtype: tuple
+"""
+def correspondence_analysis(codon_counts, n_components: int = 2):
+    counts = np.asarray(codon_counts, dtype=float)
+    rows = counts.sum(axis=1) > 0
+    cols = counts.sum(axis=0) > 0
+    table = counts[rows][:, cols]
+    P = table / table.sum()
+    r = P.sum(axis=1)
+    c = P.sum(axis=0)
+    standardized = (P - np.outer(r, c)) / np.sqrt(np.outer(r, c))
+    u, s, vt = np.linalg.svd(standardized, full_matrices=False)
+    k = min(n_components, len(s))
+    inertia = s**2
+    explained = inertia[:k] / inertia.sum() if inertia.sum() > 0 else inertia[:k]
+
+    row_coords = np.zeros((len(counts), k))
+    row_coords[rows] = (u[:, :k] * s[:k]) / np.sqrt(r)[:, None]
+    col_coords = np.zeros((counts.shape[1], k))
+    col_coords[cols] = (vt[:k].T * s[:k]) / np.sqrt(c)[:, None]
+    return row_coords, col_coords, explained
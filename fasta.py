@@ -0,0 +1,99 @@
+# reads sequences from fasta files one record at a time
+import gzip
+
+# bytes removed from sequence lines (line breaks and spaces)
+whitespace = b' \t\n\r\v\f'
+
+"""
+Opens a fasta file for reading as text, gzip compressed files are decompressed on the fly
+
+:param str file_name: path to the fasta file (plain or gzip compressed)
+:param str mode: 'r' for text, 'rb' for bytes
+:return: open file handle
+"""
+def open_fasta(file_name: str, mode: str = 'r'):
+    # check the gzip magic number rather than trusting the file extension
+    with open(file_name, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+    if is_gzip:
+        return gzip.open(file_name, 'rt' if mode == 'r' else 'rb')
+    return open(file_name, mode)
+
+"""
+Generator over the records of a fasta file as bytes, reading the file in large blocks
+The records that end in a block are split apart with one bytes.split call and each sequence is stripped of line breaks
+and spaces with one bytes.translate call, so no per line objects are built; a record longer than a block is
+collected block by block and joined once
+
+:param str file_name: path to the fasta file (plain or gzip compressed)
+:param int block_size: number of bytes read at a time
+:return: yields (name, sequence) for each record, name is the header up to the first space (like Biopython's record.id),
+         sequence the bases as bytes
+:rtype: generator
+"""
+def iter_fasta(file_name: str, block_size: int = 1024**2):
+    with open_fasta(file_name, 'rb') as fa:
+        block = fa.read(block_size).lstrip()
+        if block and not block.startswith(b'>'):
+            raise ValueError(f"{file_name} does not start with a '>' header line")
+        pending = []    # bytes of the records not yielded yet, starting with a '>'
+        tail = b''      # last byte read, it can be the line break before the next header
+        while block:
+            data = tail + block
+            cut = data.rfind(b'\n>')
+            if cut == -1:
+                pending.append(data[:-1])
+            else:
+                # every record before cut is complete
+                pending.append(data[:cut])
+                yield from split_records(b''.join(pending))
+                pending = [data[cut + 1:-1]]
+            tail = data[-1:]
+            block = fa.read(block_size)
+        yield from split_records(b''.join(pending) + tail)
+
+"""
+Splits bytes holding whole fasta records
+
+:param bytes chunk: records, starting with the '>' of the first one
+:return: yields (name, sequence) for each record, see iter_fasta
+:rtype: generator
+"""
+def split_records(chunk: bytes):
+    if not chunk:
+        return
+    for record in chunk[1:].split(b'\n>'):
+        header, _, seq = record.partition(b'\n')
+        yield record_name(header), seq.translate(None, whitespace)
+
+"""
+Extracts the record name from a header line
+
+:param bytes header: header line without the '>'
+:return: the header up to the first space, '' for an empty header
+:rtype: str
+"""
+def record_name(header: bytes):
+    fields = header.split(None, 1)
+    return fields[0].decode() if fields else ''
+
+"""
+Generator over the records of a fasta file, only one record is held in memory at a time
+
+:param str file_name: path to the fasta file (plain or gzip compressed)
+:param str parser: 'native' for the built in block reader (see iter_fasta), 'biopython' for Bio.SeqIO,
+                   which also accepts comment lines before the first record and other variations
+:return: yields (name, sequence) for each record, the sequence as bytes from the native reader (the analysis
+         functions take it as is, bytes that are not bases count as invalid) and as a str from biopython
+:rtype: generator
+"""
+def read_fasta(file_name: str, parser: str = 'native'):
+    if parser == 'native':
+        yield from iter_fasta(file_name)
+        return
+    if parser != 'biopython':
+        raise ValueError(f"parser must be 'native' or 'biopython', not {parser!r}")
+    from Bio import SeqIO   # imported here so importing this module stays fast
+    with open_fasta(file_name) as fa:
+        for record in SeqIO.parse(fa, 'fasta'):
+            yield record.id, str(record.seq)
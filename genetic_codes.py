@@ -0,0 +1,93 @@
+# NCBI genetic codes (translation tables), each compiled once into index arrays over the 64 codon slots of analysis.codon_list
+# pass the compiled code to the analysis functions (code=...) to count amino acids and compute RSCU and ENC with it
+import numpy as np
+import analysis
+
+# table number: (name, codons that code for something else than in the standard code, start codons)
+# see https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi, tables 27, 28 and 31 are left out because whether
+# their stop codons are read through depends on where they are in the gene
+ncbi_tables = {
+    1: ('Standard', {}, ['UUG', 'CUG', 'AUG']),
+    2: ('Vertebrate Mitochondrial', {'AGA': '*', 'AGG': '*', 'AUA': 'M', 'UGA': 'W'},
+        ['AUU', 'AUC', 'AUA', 'AUG', 'GUG']),
+    3: ('Yeast Mitochondrial', {'AUA': 'M', 'CUU': 'T', 'CUC': 'T', 'CUA': 'T', 'CUG': 'T', 'UGA': 'W'},
+        ['AUA', 'AUG', 'GUG']),
+    4: ('Mold, Protozoan, and Coelenterate Mitochondrial and Mycoplasma/Spiroplasma', {'UGA': 'W'},
+        ['UUA', 'UUG', 'CUG', 'AUU', 'AUC', 'AUA', 'AUG', 'GUG']),
+    5: ('Invertebrate Mitochondrial', {'AGA': 'S', 'AGG': 'S', 'AUA': 'M', 'UGA': 'W'},
+        ['UUG', 'AUU', 'AUC', 'AUA', 'AUG', 'GUG']),
+    6: ('Ciliate, Dasycladacean and Hexamita Nuclear', {'UAA': 'Q', 'UAG': 'Q'}, ['AUG']),
+    9: ('Echinoderm and Flatworm Mitochondrial', {'AAA': 'N', 'AGA': 'S', 'AGG': 'S', 'UGA': 'W'}, ['AUG', 'GUG']),
+    10: ('Euplotid Nuclear', {'UGA': 'C'}, ['AUG']),
+    11: ('Bacterial, Archaeal and Plant Plastid', {}, ['UUG', 'CUG', 'AUU', 'AUC', 'AUA', 'AUG', 'GUG']),
+    12: ('Alternative Yeast Nuclear', {'CUG': 'S'}, ['CUG', 'AUG']),
+    13: ('Ascidian Mitochondrial', {'AGA': 'G', 'AGG': 'G', 'AUA': 'M', 'UGA': 'W'}, ['UUG', 'AUA', 'AUG', 'GUG']),
+    14: ('Alternative Flatworm Mitochondrial', {'AAA': 'N', 'AGA': 'S', 'AGG': 'S', 'UAA': 'Y', 'UGA': 'W'}, ['AUG']),
+    16: ('Chlorophycean Mitochondrial', {'UAG': 'L'}, ['AUG']),
+    21: ('Trematode Mitochondrial', {'UGA': 'W', 'AUA': 'M', 'AGA': 'S', 'AGG': 'S', 'AAA': 'N'}, ['AUG', 'GUG']),
+    22: ('Scenedesmus obliquus Mitochondrial', {'UCA': '*', 'UAG': 'L'}, ['AUG']),
+    23: ('Thraustochytrium Mitochondrial', {'UUA': '*'}, ['AUU', 'AUG', 'GUG']),
+    24: ('Rhabdopleuridae Mitochondrial', {'AGA': 'S', 'AGG': 'K', 'UGA': 'W'}, ['UUG', 'CUG', 'AUG', 'GUG']),
+    25: ('Candidate Division SR1 and Gracilibacteria', {'UGA': 'G'}, ['UUG', 'AUG', 'GUG']),
+    26: ('Pachysolen tannophilus Nuclear', {'CUG': 'A'}, ['CUG', 'AUG']),
+    29: ('Mesodinium Nuclear', {'UAA': 'Y', 'UAG': 'Y'}, ['AUG']),
+    30: ('Peritrich Nuclear', {'UAA': 'E', 'UAG': 'E'}, ['AUG']),
+    33: ('Cephalodiscidae Mitochondrial', {'UAA': 'Y', 'AGA': 'S', 'AGG': 'K', 'UGA': 'W'}, ['UUG', 'CUG', 'AUG', 'GUG']),
+}
+
+# compiled codes of this process, keys are table numbers
+compiled_codes = {}
+
+"""
+A genetic code compiled into arrays over the 64 codon slots (see analysis.codon_list)
+Stop codons are counted as the amino acid '*', like in the standard analysis.codon_table
+"""
+class GeneticCode:
+    """
+    :param int table_id: NCBI table number
+    :param str name: name of the code
+    :param dict codon_table: keys are codons (rna), values are one letter amino acids
+    :param list start_codons: codons that can start translation
+    """
+    def __init__(self, table_id: int, name: str, codon_table: dict, start_codons):
+        self.table_id = table_id
+        self.name = name
+        self.codon_table = {codon: codon_table[codon] for codon in analysis.codon_list}
+        self.rev_codon_table = {}
+        for codon, aa in self.codon_table.items():
+            self.rev_codon_table.setdefault(aa, []).append(codon)
+        self.amino_acid_list = list(self.rev_codon_table)
+        self.start_codons = list(start_codons)
+
+        # for each codon slot: index of its amino acid, size of its synonymous family and the expected
+        # fraction of its amino acid (1 / family size) if codons were used evenly
+        self.codon_aa_index = np.array([self.amino_acid_list.index(aa) for aa in self.codon_table.values()])
+        self.codon_family_size = np.array([len(self.rev_codon_table[aa]) for aa in self.codon_table.values()])
+        self.codon_expected_freq = 1 / self.codon_family_size
+        # 64 x n_amino_acids matrix, codon counts @ it = amino acid counts
+        self.codon_aa_matrix = np.zeros((64, len(self.amino_acid_list)), dtype=np.int64)
+        self.codon_aa_matrix[np.arange(64), self.codon_aa_index] = 1
+        # 65 entries so codon slots with an invalid base (64) can be looked up too
+        self.stop_mask = np.zeros(65, dtype=bool)
+        self.stop_mask[:64] = [aa == '*' for aa in self.codon_table.values()]
+        self.start_mask = np.zeros(65, dtype=bool)
+        self.start_mask[[analysis.codon_list.index(codon) for codon in self.start_codons]] = True
+        # codons of amino acids with more than one codon, not stops (see analysis.gc3s_values)
+        self.synonymous_mask = (self.codon_family_size > 1) & ~self.stop_mask[:64]
+
+"""
+Returns a genetic code, compiling it the first time it is used in this process
+
+:param table_id: NCBI table number, or an already compiled GeneticCode (returned unchanged)
+:return: the compiled code
+:rtype: GeneticCode
+"""
+def get_genetic_code(table_id=1):
+    if isinstance(table_id, GeneticCode):
+        return table_id
+    if table_id not in ncbi_tables:
+        raise ValueError(f"unknown genetic code {table_id!r}, available tables: {sorted(ncbi_tables)}")
+    if table_id not in compiled_codes:
+        name, changes, start_codons = ncbi_tables[table_id]
+        compiled_codes[table_id] = GeneticCode(table_id, name, dict(analysis.codon_table, **changes), start_codons)
+    return compiled_codes[table_id]
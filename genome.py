@@ -0,0 +1,239 @@
+# whole genome mode: codon counts, GC content and windowed GC computed in chunks straight from a memory mapped fasta file
+# so a chromosome is never read into one python string (or copied by .upper() / .replace())
+import mmap
+import os
+from collections import namedtuple
+import numpy as np
+import analysis
+
+# one line of a .fai index (same columns as samtools faidx):
+# name, number of bases, byte offset of the first base, bases per line, bytes per line (including the newline)
+FaiEntry = namedtuple('FaiEntry', ['name', 'length', 'offset', 'line_bases', 'line_width'])
+
+# True for the byte values that are not part of the sequence (line breaks and spaces)
+whitespace_mask = np.zeros(256, dtype=bool)
+whitespace_mask[np.frombuffer(b' \t\n\r\v\f', dtype=np.uint8)] = True
+
+# open memory mapped fasta files of this process, keys are file paths
+open_fastas = {}
+
+"""
+Reads a .fai index file
+
+:param str fai_file: path to the index
+:return: one entry per record, in file order
+:rtype: list
+"""
+def read_fai(fai_file: str):
+    entries = []
+    with open(fai_file) as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 5:
+                entries.append(FaiEntry(fields[0], *map(int, fields[1:5])))
+    return entries
+
+"""
+Writes a .fai index file
+
+:param str fai_file: path to write to
+:param list entries: index entries (see read_fai)
+"""
+def write_fai(fai_file: str, entries):
+    with open(fai_file, 'w') as file:
+        for entry in entries:
+            file.write('\t'.join(map(str, entry)) + '\n')
+
+"""
+Memory mapped plain (not compressed) fasta file
+The records are found with the .fai index next to the file (<file>.fai), which is built and saved if it does not exist.
+Only the start of each record is taken from the index, so lines can have any length and contain spaces
+"""
+class MappedFasta:
+    """
+    :param str file_name: path to the fasta file
+    :param int chunk_bases: about how many bases are processed at a time, this bounds the memory used per record
+    """
+    def __init__(self, file_name: str, chunk_bases: int = 8 * 1024**2):
+        with open(file_name, 'rb') as f:
+            if f.read(2) == b'\x1f\x8b':
+                raise ValueError(f"{file_name} is gzip compressed, whole genome mode needs a plain fasta file")
+        self.file_name = file_name
+        self.chunk_bases = chunk_bases
+        self.file = open(file_name, 'rb')
+        if os.path.getsize(file_name) == 0:
+            self.map = None     # an empty file cannot be memory mapped
+            self.data = np.zeros(0, dtype=np.uint8)
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            # view of the mapped bytes, no copy
+            self.data = np.frombuffer(self.map, dtype=np.uint8)
+
+        fai_file = file_name + '.fai'
+        if os.path.exists(fai_file):
+            self.entries = read_fai(fai_file)
+        else:
+            self.entries = self.build_index()
+            try:
+                write_fai(fai_file, self.entries)
+            except OSError:
+                pass    # read only folder, the index is rebuilt next time
+        self.records = {entry.name: entry for entry in self.entries}
+
+    """
+    Scans the file for records and their line layout
+
+    :return: one index entry per record, in file order
+    :rtype: list
+    """
+    def build_index(self):
+        entries = []
+        start = self.map.find(b'>') if self.map is not None else -1
+        while start != -1:
+            header_end = self.map.find(b'\n', start)
+            if header_end == -1:
+                header_end = len(self.map)
+            name = bytes(self.map[start+1:header_end]).decode().split(maxsplit=1)
+            name = name[0] if name else ''
+            offset = header_end + 1
+            end = self.map.find(b'\n>', header_end)
+            end = len(self.map) if end == -1 else end + 1
+
+            # line layout from the first line (for samtools compatible .fai files), the number of bases from the whole record
+            first_line_end = self.map.find(b'\n', offset, end)
+            if first_line_end == -1:
+                first_line_end = end
+            line_width = first_line_end - offset + 1
+            line_bases = line_width - int(np.count_nonzero(whitespace_mask[self.data[offset:first_line_end + 1]]))
+            length = 0
+            for chunk_start in range(offset, end, self.chunk_bases):
+                raw = self.data[chunk_start:min(chunk_start + self.chunk_bases, end)]
+                length += len(raw) - int(np.count_nonzero(whitespace_mask[raw]))
+            entries.append(FaiEntry(name, length, offset, line_bases, line_width))
+            start = end if end < len(self.map) else -1
+        return entries
+
+    """
+    Generator over the bases of a record in chunks, line breaks and spaces are removed so only one chunk is copied at a time
+
+    :param FaiEntry entry: the record (see self.records)
+    :return: yields uint8 arrays of bases (ascii codes)
+    :rtype: generator
+    """
+    def chunks(self, entry: FaiEntry):
+        if entry.length == 0:
+            return
+        # the record ends where the next one starts, '>' cannot be part of a sequence
+        end = self.map.find(b'>', entry.offset)
+        if end == -1:
+            end = len(self.map)
+        for start in range(entry.offset, end, self.chunk_bases):
+            raw = self.data[start:min(start + self.chunk_bases, end)]
+            yield raw[~whitespace_mask[raw]]
+
+    """
+    Computes the statistics of one record chunk by chunk, the same values as main.sequence_stats gives for the
+    whole sequence except that codons containing a base other than A, C, G, T or U are skipped (and counted)
+    instead of raising an error
+
+    :param str name: name of the record
+    :param int window_size: window size of the gc content distribution, None to skip it
+    :param int step: distance between the starts of consecutive windows
+    :param str window_file: file to write the g/c count of every window to (uint16, see analysis.gc_window_percent),
+                            the windows are kept in memory if None
+    :return: codon_counts, invalid_codons, gc, gc12, gc3, length, window_size and gc_window_counts (an array, or the path
+             of window_file), gc_profile is None since a percentage per base of a chromosome does not fit in memory
+    :rtype: dict
+    """
+    def stats(self, name: str, window_size=30, step: int = 1, window_file=None):
+        entry = self.records[name]
+        if window_size is not None and window_size > np.iinfo(np.uint16).max:
+            raise ValueError(f"window_size must be at most {np.iinfo(np.uint16).max} in whole genome mode")
+
+        counts = np.zeros(65, dtype=np.int64)   # slot 64 counts codons with an invalid base
+        gc_total = 0
+        gc3_total = 0
+        position = 0
+        codon_rest = np.zeros(0, dtype=np.uint8)    # bases of a codon split between two chunks
+
+        # windows: g/c flags of the bases the next window starts at, carried over to the next chunk
+        windows = []
+        window_out = open(window_file, 'wb') if window_size is not None and window_file is not None else None
+        window_tail = np.zeros(0, dtype=np.uint8)
+        next_start = 0
+        starts_end = max(entry.length - window_size, 0) if window_size is not None else 0
+
+        try:
+            for bases in self.chunks(entry):
+                is_gc = analysis.gc_base_mask[bases]
+                gc_total += int(np.count_nonzero(is_gc))
+                # the base at position p is at codon position p % 3 + 1
+                gc3_total += int(np.count_nonzero(is_gc[(2 - position) % 3::3]))
+
+                codon_bases = np.concatenate((codon_rest, bases)) if len(codon_rest) else bases
+                n_codons = len(codon_bases) // 3
+                counts += analysis.codon_tally(codon_bases[:n_codons * 3])
+                codon_rest = codon_bases[n_codons * 3:]
+
+                if window_size is not None:
+                    buffer = np.concatenate((window_tail, is_gc.view(np.uint8)))
+                    buffer_start = position - len(window_tail)
+                    cumulative = np.zeros(len(buffer) + 1, dtype=np.int64)
+                    np.cumsum(buffer, out=cumulative[1:])
+                    starts = np.arange(next_start, min(buffer_start + len(buffer) - window_size + 1, starts_end), step)
+                    if len(starts):
+                        local = starts - buffer_start
+                        window_counts = (cumulative[local + window_size] - cumulative[local]).astype(np.uint16)
+                        if window_out is not None:
+                            window_out.write(window_counts.tobytes())
+                        else:
+                            windows.append(window_counts)
+                        next_start = int(starts[-1]) + step
+                    window_tail = buffer[min(next_start - buffer_start, len(buffer)):]
+                position += len(bases)
+        finally:
+            if window_out is not None:
+                window_out.close()
+
+        length = entry.length
+        n_gc3 = length // 3
+        gc12 = round((gc_total - gc3_total) / (length - n_gc3) * 100, 4)
+        gc3 = round(gc3_total / n_gc3 * 100, 4)
+        stats = {
+            'codon_counts': counts[:64],
+            'invalid_codons': int(counts[64]),
+            'gc': round(gc_total / length * 100, 4),
+            'gc12': gc12,
+            'gc3': gc3,
+            'gc_profile': None,
+            'length': length,
+        }
+        if window_size is not None:
+            stats['window_size'] = window_size
+            if window_file is not None:
+                stats['gc_window_counts'] = window_file
+            else:
+                stats['gc_window_counts'] = np.concatenate(windows) if windows else np.zeros(0, dtype=np.uint16)
+        return stats
+
+    """
+    Unmaps and closes the file
+    """
+    def close(self):
+        self.data = None
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+"""
+Returns the memory mapped fasta file of this process for a path, opening it the first time
+
+:param str file_name: path to the fasta file
+:return: the mapped file
+:rtype: MappedFasta
+"""
+def get_mapped_fasta(file_name: str):
+    file_name = os.path.abspath(file_name)
+    if file_name not in open_fastas:
+        open_fastas[file_name] = MappedFasta(file_name)
+    return open_fastas[file_name]
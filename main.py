@@ -1,13 +1,57 @@
 import os
-from Bio import SeqIO
+import time
+import numpy as np
 import analysis
-import plotting
+import orf
+from adaptation import cai_weights, load_weights, read_trna_counts, tai_weights
+from bulk_output import BulkWriter
+from cache import cache_key, flush_caches, get_cache
+from codon_pairs import load_pair_table, pair_counts, pair_table
+from distance import codon_profiles, correspondence_analysis, distance_matrix, leaf_order, linkage, linkage_max_bytes, pca
+from fasta import iter_fasta, read_fasta
+from genetic_codes import get_genetic_code
+from genome import get_mapped_fasta
+from timing import StageTimer
+from windows import cds_codon_slots, codon_window_tracks, write_tracks
 
 # PARAMETERS
-sequence_file_name = ''     # name of the file containing your sequence(s) for analysis
+sequence_file_name = ''     # name of the file containing your sequence(s) for analysis (plain or gzip compressed fasta)
+fasta_parser = 'native'     # 'native' for the built in fasta reader, 'biopython' to read the file with Bio.SeqIO
+                            # (which also accepts comment lines before the first record)
 output_folder_name = ''     # name of folder to save output graphs and files to
 single_only = True          # True to calculate single sequence statistics for only the first sequence in the file
                             # False to calculate single sequence statistics for all sequences in the file
+genome_mode = False         # True for whole chromosomes / genomes: the (plain, not gzip compressed) fasta file is memory mapped and
+                            # each record is analyzed in chunks without reading it into memory, using the <file>.fai index (built if missing).
+                            # Codons containing other bases than A, C, G, T, U (such as N) are skipped, the GC distribution is saved
+                            # as window g/c counts in <name>_gc_windows.u16 instead of _gc_dist.txt, and the cache is not used
+cds_source = None           # None to count codons over the whole sequence
+                            # 'orf' to only count the longest open reading frame of each sequence (on either strand), for example the CDS of an mRNA
+                            # or the name of a GFF (.gff, .gff3) or GenBank (.gb, .gbk) file with the CDS coordinates of each sequence
+                            # codon counts, GC12 and GC3 then only cover the CDS, GC and the GC distribution still cover the whole sequence
+genetic_code = 1            # NCBI translation table number used to translate codons to amino acids and group synonymous codons,
+                            # for example 2 for vertebrate mitochondria, 4 for mold/protozoan mitochondria and mycoplasma, 6 for ciliates
+                            # (see genetic_codes.ncbi_tables)
+invalid_codons = 'raise'    # what to do with codons containing an ambiguous or invalid base (N, R, Y, ...)
+                            # 'raise' to report the sequence as failed, 'skip' to leave them out of the counts,
+                            # the number skipped is then reported per sequence (in the progress output, the codon usage file and the bulk summary table)
+codon_window = None         # None to skip, or the number of codons per sliding window for local codon usage tracks of each single analyzed sequence:
+                            # GC3, GC3s, ENC and RSCU of every window go to <name>_codon_windows.tsv and a graph (not in whole genome mode)
+codon_window_step = 10      # distance between the starts of consecutive windows, in codons
+workers = 1                 # number of processes to analyze sequences in parallel, 1 to analyze them one after another
+use_cache = False           # True to keep the codon counts and gc content of each sequence in a cache file, so they are not recomputed
+                            # for sequences analyzed in an earlier run
+cache_file = ''             # cache file to use, leave empty to keep it in the output folder
+cache_max_mb = 1024         # size limit of the cache file, the least recently used sequences are removed past it
+plot_format = 'png'         # file format of the graphs, 'png' or 'svg'
+                            # None to only write the statistics files and not make any graphs (matplotlib is then never loaded)
+plot_dpi = 300              # resolution of the graphs
+bulk_format = None          # None to write 4 statistics text files per sequence
+                            # 'tsv' or 'parquet' to write one codon count table, one RSCU table and one summary table for all sequences,
+                            # and the GC distributions of all sequences to one gc_profiles.u16 file (see bulk_output.load_gc_profiles)
+report_timing = False       # True to save the time, number of calls and bytes written of each stage to timing.json in the output folder
+profile = None              # None, 'cprofile' to also save a profile_<stage>.prof file per stage,
+                            # or 'tracemalloc' to also record the peak memory of each stage (both run in a single process)
 
 # the following parameters are only required for multiple sequence analysis
 compare = False             # True to generate RSCU heatmap, ENC, and ENC vs GC3 graphs that compare all the squences in the input file
@@ -15,95 +59,727 @@ compare = False             # True to generate RSCU heatmap, ENC, and ENC vs GC3
 multi_only = True           # True to only generate the above and not perform any single sequence analyses
                             # False to perform both single and multiple sequence analyses
 heatmap_title = ''          # title for RSCU heatmap
+heatmap_max_rows = None     # most rows drawn in the RSCU heatmap, None to draw every sequence
+heatmap_reduce = 'group'    # 'group' to draw the average of groups of similar sequences when there are more than heatmap_max_rows
+                            # 'sample' to draw evenly spaced sequences instead
+heatmap_order = 'cluster'   # 'cluster' to draw sequences with similar RSCU next to each other (hierarchical clustering), 'input' for file order
+distance_metric = None      # None to skip, or 'euclidean', 'cosine', 'chi-square' or 'jensen-shannon' to save the distances between the RSCU
+                            # of all compared sequences to codon_distances.npy, and their clustering, PCA and correspondence analysis
+                            # coordinates to codon_usage_structure.tsv
 seq_names = []              # names / labels for the sequences to be used in the RSCU, ENC, and ENC vs GC3 graphs
+                            # leave empty to use the names in the file
 enc_title = ''              # title for the ENC bar graph
+enc_method = 'wright'       # 'wright' for Wright's ENC, 'novembre' to correct it for the base composition of each sequence (Novembre 2002)
 enc_gc3_title = ''          # title for the ENC vs GC3 graph
 
-# read file
-script_dir = os.path.dirname(os.path.abspath(__file__))
-file_name = os.path.join(script_dir, sequence_file_name)
-
-# open file as fasta (each line is either the name of a sequence or a sequence itself)
-names = []
-seqs = []
-with open(file_name, 'r') as fa:
-    for record in SeqIO.parse(fa, 'fasta'):
-        names.append(record.id)
-        seqs.append(str(record.seq))
-
-# directories to save things to
-output_dir = output_folder_name
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
-
-tot = 1
-if not single_only:
-    tot = len(names)    # calculate stats for all sequences
-if multi_only:
-    tot = 0
-    
-for i in range(tot):
-    # computing codon count and frequencies
-    seq_name = names[i]
-    seq = seqs[i]
-    data = analysis.analyze_codons(seq)
-
-    # Generate codon usage bar graph
-    # Create dynamic filename to avoid overwriting, replace invalid characters with '_'
+# codon adaptation scores, written to adaptation_scores.tsv for every analyzed sequence
+cai_reference = None        # None to skip the Codon Adaptation Index, or a fasta file of reference (highly expressed) coding sequences,
+                            # the weights built from it are saved to cai_weights.json in the output folder, which can be given here instead next time
+trna_counts = None          # None to skip the tRNA Adaptation Index, or a text file with one anticodon and its tRNA gene copy number per line,
+                            # the weights are saved to tai_weights.json in the output folder, which can be given here instead next time
+cpb_reference = None        # None to skip the Codon Pair Bias, or a fasta file of reference coding sequences to build codon pair scores from,
+                            # the scores are saved to cps_table.json in the output folder, which can be given here instead next time
+
+"""
+Replaces characters that are not allowed in file names with '_'
+
+:param str seq_name: name of the sequence
+:return: name that is safe to use in a file name
+:rtype: str
+"""
+def safe_filename(seq_name: str):
     safe_name = seq_name
     for char in '\\/:*?"<>|':
         safe_name = safe_name.replace(char, '_')
-    output_filename = os.path.join(output_dir, f'{safe_name}_codon_usage.png')
-    plotting.bar_count_freq(data, "Codon Count and Frequency", "Codon", output_filename)
-
-    # write codon usage output to file
-    output_filename = os.path.join(output_dir, f'{safe_name}_codon_usage.txt')
-    with open(output_filename, 'w') as file:
-        for key, val in data.items():
-            file.write(key + ': ' + str(val) + '\n')
-
-    # computing amino acid count and frequencies and plotting
-    aa_data = analysis.analyze_amino_acids(data)
-    output_filename = os.path.join(output_dir, f'{safe_name}_amino_acid_usage.png')
-    plotting.bar_count_freq(aa_data, "Amino Acid Count and Frequency", "Amino Acid", output_filename)
-
-    # write amino acid count and frequency output to file
-    output_filename = os.path.join(output_dir, f'{safe_name}_amino_acid_usage.txt')
-    with open(output_filename, 'w') as file:
-        for key, val in aa_data.items():
-            file.write(key + ': ' + str(val) + '\n')
-
-    # calculating Relative Synonymous Codon Usage and plotting
-    rscu_data = analysis.rscu(data, aa_data)
-    output_filename = os.path.join(output_dir, f'{safe_name}_rscu.png')
-    plotting.rscu(rscu_data, output_filename)
-
-    # write RSCU output to file
-    output_filename = os.path.join(output_dir, f'{safe_name}_rscu.txt')
-    with open(output_filename, 'w') as file:
-        for key, val in rscu_data.items():
-            file.write(key + ': ' + str(val) + '\n')
-
-    # calculating gc content and plotting it
-    output_filename = os.path.join(output_dir, f'{safe_name}_gc_dist.png')
-    output2_filename = os.path.join(output_dir, f'{safe_name}_gc_bp.png')
-    gc = plotting.gc(seq, 30, output_filename, output2_filename)
-
-    # write GC distribution output to file
-    output_filename = os.path.join(output_dir, f'{safe_name}_gc_dist.txt')
-    with open(output_filename, 'w') as file:
-        for i in range(len(gc)):
-            file.write(str(i+1) + ',' + str(gc[i]) + '\n')
-
-if compare:
-    # rscu heatmap
-    output_filename = os.path.join(output_dir, 'RSCU_heatmap.png')
-    plotting.rscu_heatmap(seq_names, seqs, heatmap_title, output_filename)
-
-    # calculate and plot all enc values
-    output_filename = os.path.join(output_dir, 'ENC_values.png')
-    plotting.enc(seq_names, seqs, enc_title, output_filename)
-
-    # enc vs gc3
-    output_filename = os.path.join(output_dir, 'ENC_vs_GC3.png')
-    plotting.enc_vs_gc3(seq_names, seqs, enc_gc3_title, output_filename)
\ No newline at end of file
+    return safe_name
+
+"""
+Loads the plotting module and applies the render settings, in the process it is called from
+
+:param str plot_format: file format of the graphs, None to not make graphs
+:param int dpi: resolution of the graphs
+:return: the plotting module, or None if no graphs are made
+"""
+def load_plotting(plot_format='png', dpi=300):
+    if plot_format is None:
+        return None
+    # imported here so runs without graphs never load matplotlib
+    import plotting
+    plotting.configure(dpi, plot_format)
+    return plotting
+
+"""
+Computes the statistics of one sequence that the single sequence outputs are made from
+If a cache is given, the codon counts and gc content stored for the same sequence are reused and new ones are stored,
+the gc distribution is always computed
+
+:param seq: the sequence to be analyzed, as a str or bytes (see fasta.read_fasta)
+:param int window_size: window size of the gc content distribution
+:param StatsCache stats_cache: cache to use (see cache.get_cache), or None
+:param StageTimer timer: records the time spent in each stage, or None
+:param list cds: coding sequences (see orf) to count the codons of, None to count them over the whole sequence
+:param str invalid: 'raise' to raise a KeyError if a codon contains an invalid base, 'skip' to leave them out of the counts
+:return: codon_counts, invalid_codons, gc, gc12, gc3 and gc_profile
+:rtype: dict
+"""
+def sequence_stats(seq, window_size: int = 30, stats_cache=None, timer=None, cds=None, invalid='raise'):
+    if timer is None:
+        timer = StageTimer()
+
+    stats = None
+    if stats_cache is not None:
+        with timer.stage('cache'):
+            key = cache_key(seq, cds=cds)
+            stats = stats_cache.get(key)
+
+    if stats is None:
+        with timer.stage('count'):
+            if cds is None:
+                gc12, gc3 = analysis.gc_codon_positions(seq)
+                tally = analysis.codon_tally(seq)
+            else:
+                gc12, gc3 = orf.cds_gc_positions(seq, cds)
+                tally = orf.cds_codon_tally(seq, cds)
+            stats = {
+                'codon_counts': tally[:64],
+                'invalid_codons': int(tally[64]),
+                'gc': analysis.gc(seq),
+                'gc12': gc12,
+                'gc3': gc3,
+            }
+        if stats_cache is not None:
+            with timer.stage('cache'):
+                stats_cache.put(key, stats)
+
+    with timer.stage('gc_windows'):
+        stats['gc_profile'] = analysis.gc_profile(seq, window_size)
+
+    if stats['invalid_codons'] and invalid == 'raise':
+        # same error as analysis.codon_counts
+        raise KeyError(analysis.first_invalid_codon(seq) if cds is None else orf.first_invalid_codon(seq, cds))
+    return stats
+
+"""
+Returns the window g/c counts of whole genome mode statistics (see genome.MappedFasta.stats), memory mapped
+if they were written to a file
+
+:param dict stats: statistics of the sequence
+:return: g/c count of each window, empty if there are none
+:rtype: numpy.ndarray
+"""
+def load_window_counts(stats: dict):
+    window_counts = stats.get('gc_window_counts')
+    if window_counts is None:
+        return np.zeros(0, dtype=np.uint16)
+    if isinstance(window_counts, str):
+        if os.path.getsize(window_counts) == 0:
+            return np.zeros(0, dtype=np.uint16)     # an empty file cannot be memory mapped
+        return np.memmap(window_counts, dtype=np.uint16, mode='r')
+    return window_counts
+
+"""
+Computes, plots and writes all single sequence statistics for one sequence
+
+:param str seq_name: name of the sequence, used for the output file names
+:param seq: the sequence to be analyzed, as a str or bytes, can be None if stats are given
+:param str output_dir: folder to save output graphs and files to
+:param dict stats: statistics of the sequence (see sequence_stats), computed if not given
+                   if its gc_profile is None (see genome.MappedFasta.stats) the gc distribution graph is drawn from
+                   its gc_window_counts and the text file is skipped
+:param str plot_format: file format of the graphs, None to only write the statistics files
+:param int dpi: resolution of the graphs
+:param bool write_text: False to skip the statistics text files (when they are written in bulk instead)
+:param StageTimer timer: records the time spent in each stage, or None
+:param int genetic_code: NCBI translation table number (see genetic_codes)
+"""
+def analyze_single(seq_name: str, seq, output_dir: str, stats=None, plot_format='png', dpi=300, write_text=True,
+                   timer=None, genetic_code=1):
+    if timer is None:
+        timer = StageTimer()
+    if stats is None:
+        stats = sequence_stats(seq, timer=timer)
+    plotting = load_plotting(plot_format, dpi)
+
+    # Create dynamic filename to avoid overwriting, replace invalid characters with '_'
+    safe_name = safe_filename(seq_name)
+    gc = stats['gc_profile']
+
+    with timer.stage('derive'):
+        # codon count, amino acid count and Relative Synonymous Codon Usage
+        data = dict(zip(analysis.codon_list, stats['codon_counts'].tolist()))
+        code = get_genetic_code(genetic_code)
+        aa_data = analysis.analyze_amino_acids(data, code)
+        rscu_data = analysis.rscu(data, aa_data, code)
+
+    if plotting:
+        with timer.stage('render') as written:
+            # Generate codon usage bar graph
+            output_filename = os.path.join(output_dir, f'{safe_name}_codon_usage.{plot_format}')
+            plotting.bar_count_freq(data, "Codon Count and Frequency", "Codon", output_filename)
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # amino acid count and frequencies bar graph
+            output_filename = os.path.join(output_dir, f'{safe_name}_amino_acid_usage.{plot_format}')
+            plotting.bar_count_freq(aa_data, "Amino Acid Count and Frequency", "Amino Acid", output_filename)
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # RSCU graph
+            output_filename = os.path.join(output_dir, f'{safe_name}_rscu.{plot_format}')
+            plotting.rscu(rscu_data, output_filename)
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # gc content graphs
+            if gc is not None:
+                output_filename = os.path.join(output_dir, f'{safe_name}_gc_dist.{plot_format}')
+                plotting.gc_distribution(gc, len(seq) if seq is not None else stats['length'], output_filename)
+                written['bytes'] += os.path.getsize(output_filename)
+            elif len(window_counts := load_window_counts(stats)):
+                # whole genome mode: drawn from the window g/c counts, downsampled to the figure width
+                output_filename = os.path.join(output_dir, f'{safe_name}_gc_dist.{plot_format}')
+                plotting.gc_distribution(window_counts, stats['length'], output_filename,
+                                         window_size=stats['window_size'])
+                written['bytes'] += os.path.getsize(output_filename)
+            output_filename = os.path.join(output_dir, f'{safe_name}_gc_bp.{plot_format}')
+            plotting.gc_positions(stats['gc'], stats['gc12'], stats['gc3'], output_filename)
+            written['bytes'] += os.path.getsize(output_filename)
+
+    if write_text:
+        with timer.stage('write') as written:
+            # write codon usage output to file
+            output_filename = os.path.join(output_dir, f'{safe_name}_codon_usage.txt')
+            with open(output_filename, 'w') as file:
+                for key, val in data.items():
+                    file.write(key + ': ' + str(val) + '\n')
+                if stats.get('invalid_codons'):
+                    # codons with ambiguous bases that were skipped
+                    file.write('invalid: ' + str(stats['invalid_codons']) + '\n')
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # write amino acid count and frequency output to file
+            output_filename = os.path.join(output_dir, f'{safe_name}_amino_acid_usage.txt')
+            with open(output_filename, 'w') as file:
+                for key, val in aa_data.items():
+                    file.write(key + ': ' + str(val) + '\n')
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # write RSCU output to file
+            output_filename = os.path.join(output_dir, f'{safe_name}_rscu.txt')
+            with open(output_filename, 'w') as file:
+                for key, val in rscu_data.items():
+                    file.write(key + ': ' + str(val) + '\n')
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # write GC distribution output to file
+            if gc is not None:
+                output_filename = os.path.join(output_dir, f'{safe_name}_gc_dist.txt')
+                with open(output_filename, 'w') as file:
+                    for i in range(len(gc)):
+                        file.write(str(i+1) + ',' + str(gc[i]) + '\n')
+                written['bytes'] += os.path.getsize(output_filename)
+
+"""
+Generator over (name, sequence) records that times reading each record as the 'parse' stage
+
+:param records: iterator over records (see fasta.read_fasta)
+:param StageTimer timer: timer to record the stage in
+:return: yields the records unchanged
+:rtype: generator
+"""
+def timed_records(records, timer):
+    while True:
+        with timer.stage('parse'):
+            record = next(records, None)
+        if record is None:
+            return
+        yield record
+
+"""
+Returns a file name that has not been used yet in this run, repeated names get a _2, _3, ... suffix
+Names are assigned in file order, so outputs are named the same no matter how many workers are used
+Every record gets one, so its output files, its rows in the tables and its labels in the comparison graphs match
+
+:param str seq_name: name of the sequence
+:param dict used: names used so far, updated in place (keys are names, values are times seen)
+:return: unique name that is safe to use in a file name
+:rtype: str
+"""
+def unique_filename(seq_name: str, used: dict):
+    name = safe_filename(seq_name)
+    used[name] = used.get(name, 0) + 1
+    if used[name] > 1:
+        name = f'{name}_{used[name]}'
+    return name
+
+"""
+Analyzes one record: single sequence statistics and/or the summary needed by the comparison graphs
+Any error is caught and returned so that one bad record does not stop the rest of the run
+
+:param str seq_name: name of the sequence, used for the output file names
+:param seq: the sequence to be analyzed as a str or bytes, or the name of the record in genome_file
+:param str output_dir: folder to save output graphs and files to
+:param bool single: True to compute, plot and write the single sequence statistics
+:param bool compare: True to compute the comparison summary
+:param str cache_file: cache file to reuse the statistics of single sequence records from (see sequence_stats), or None
+:param int cache_max_bytes: size limit of the cache file
+:param str plot_format: file format of the graphs, None to not make graphs
+:param int dpi: resolution of the graphs
+:param bool write_text: False to skip the per sequence statistics text files
+:param StageTimer timer: timer to record the stages in, a new one is used (and its records returned) if None
+:param str genome_file: fasta file to analyze the record from in whole genome mode (see genome.MappedFasta), or None
+:param cds: None to count codons over the whole sequence, 'orf' to count its longest open reading frame,
+            or a list of its coding sequences (see orf)
+:param str invalid: 'raise' to fail the record if a codon contains an invalid base, 'skip' to leave them out of the counts
+:param int genetic_code: NCBI translation table number (see genetic_codes)
+:param int codon_window: number of codons per window of the local codon usage tracks (see windows), None to skip them
+:param int codon_window_step: distance between the starts of consecutive windows, in codons
+:param str enc_method: 'wright' or 'novembre', ENC method of the codon usage tracks
+:param PairTable pair_table: codon pair scores to compute the codon pair bias of the record with (see codon_pairs),
+                             None to skip it
+:return: (stats, error, timings), stats is the sequence_stats of the record plus its length (only codon_counts and
+         invalid_codons when just the comparison summary is needed) or None, error is a message or None, timings are
+         the stage records of the new timer or None if a timer was given
+:rtype: tuple
+"""
+def process_record(seq_name: str, seq, output_dir: str, single: bool, compare: bool,
+                   cache_file=None, cache_max_bytes=1024**3, plot_format='png', dpi=300, write_text=True,
+                   timer=None, genome_file=None, cds=None, invalid='raise', genetic_code=1, codon_window=None,
+                   codon_window_step=10, enc_method='wright', pair_table=None):
+    timings = None
+    if timer is None:
+        # worker processes time each record separately and send the records back to be merged
+        timer = StageTimer()
+        timings = timer.stages
+    try:
+        if cds == 'orf':
+            with timer.stage('orf'):
+                cds = orf.longest_orf(seq, code=get_genetic_code(genetic_code))
+            if cds is None:
+                raise ValueError('no open reading frame found')
+            cds = [cds]
+        elif cds is not None and not cds:
+            raise ValueError('no CDS annotated for this sequence')
+        if cds is not None and all(sum(end - start for start, end in parts) < 3 for parts, _ in cds):
+            raise ValueError('the annotated CDS hold no complete codon')
+
+        stats = None
+        if genome_file:
+            # counted chunk by chunk from the memory mapped file, the window counts are written as they are computed
+            mapped = get_mapped_fasta(genome_file)
+            with timer.stage('count'):
+                if single:
+                    window_file = os.path.join(output_dir, f'{seq_name}_gc_windows.u16')
+                    stats = mapped.stats(seq, 30, 1, window_file)
+                else:
+                    stats = mapped.stats(seq, None)
+            if single:
+                analyze_single(seq_name, None, output_dir, stats, plot_format, dpi, write_text, timer, genetic_code)
+        elif single:
+            # full statistics, the codon counts taken from the cache if this sequence was analyzed before
+            # each worker process opens the cache file once and keeps it open
+            stats_cache = get_cache(cache_file, cache_max_bytes) if cache_file else None
+            stats = dict(sequence_stats(seq, 30, stats_cache, timer, cds, invalid), length=len(seq))
+            analyze_single(seq_name, seq, output_dir, stats, plot_format, dpi, write_text, timer, genetic_code)
+            if codon_window:
+                with timer.stage('codon_windows') as written:
+                    tracks = codon_window_tracks(cds_codon_slots(seq, cds), codon_window, codon_window_step,
+                                                 get_genetic_code(genetic_code), enc_method, rscu=True)
+                    output_filename = os.path.join(output_dir, f'{seq_name}_codon_windows.tsv')
+                    write_tracks(tracks, output_filename)
+                    written['bytes'] += os.path.getsize(output_filename)
+                    plotting = load_plotting(plot_format, dpi)
+                    if plotting:
+                        output_filename = os.path.join(output_dir, f'{seq_name}_codon_windows.{plot_format}')
+                        plotting.codon_windows(tracks, output_filename)
+                        written['bytes'] += os.path.getsize(output_filename)
+        elif compare:
+            # only the codon counts are needed, and the number of invalid codons for the progress note
+            with timer.stage('count'):
+                tally = analysis.codon_tally(seq) if cds is None else orf.cds_codon_tally(seq, cds)
+            stats = {'codon_counts': tally[:64], 'invalid_codons': int(tally[64])}
+            if tally[64] and invalid == 'raise':
+                # same error as analysis.codon_counts
+                raise KeyError(analysis.first_invalid_codon(seq) if cds is None else orf.first_invalid_codon(seq, cds))
+        if pair_table is not None:
+            # scored straight away so only one value per record is kept, not its 4096 pair counts;
+            # each CDS is counted on its own so no pair spans two genes
+            with timer.stage('codon_pairs'):
+                pairs = sum(pair_counts(slots) for slots in cds_codon_slots(seq, cds))
+                stats['cpb'] = float(pair_table.score(pairs))
+        return stats, None, timings
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}', timings
+
+"""
+Loads a saved adaptation weight table, or builds one and saves it to the output folder for later runs
+
+:param str path: saved table (.json), fasta file of reference coding sequences (cai), or tRNA gene copy number file (tai)
+:param str kind: 'cai' or 'tai'
+:param GeneticCode code: genetic code to build the weights for (see genetic_codes)
+:param str output_dir: folder to save a newly built table to, as <kind>_weights.json
+:return: the weight table
+:rtype: adaptation.WeightTable
+"""
+def load_adaptation_weights(path: str, kind: str, code, output_dir: str):
+    if path.lower().endswith('.json'):
+        table = load_weights(path)
+        if table.kind != kind:
+            raise ValueError(f"{path} holds {table.kind} weights, not {kind} weights")
+        if table.genetic_code != code.table_id:
+            raise ValueError(f"{path} was built for genetic code {table.genetic_code}, not {code.table_id}")
+        return table
+    if kind == 'cai':
+        # reference genes are counted in frame from their first base, codons with ambiguous bases are skipped
+        reference = np.zeros(64, dtype=np.int64)
+        for _, seq in iter_fasta(path):
+            reference += analysis.codon_tally(seq)[:64]
+        table = cai_weights(reference, code)
+    else:
+        table = tai_weights(read_trna_counts(path), code)
+    table.info['source'] = os.path.basename(path)
+    table.save(os.path.join(output_dir, f'{kind}_weights.json'))
+    return table
+
+"""
+Loads saved codon pair scores, or builds them from reference coding sequences and saves them to the output folder
+
+:param str path: saved table (.json) or fasta file of reference coding sequences
+:param GeneticCode code: genetic code to build the scores for (see genetic_codes)
+:param str output_dir: folder to save a newly built table to, as cps_table.json
+:return: the codon pair scores
+:rtype: codon_pairs.PairTable
+"""
+def load_pair_scores(path: str, code, output_dir: str):
+    if path.lower().endswith('.json'):
+        table = load_pair_table(path)
+        if table.genetic_code != code.table_id:
+            raise ValueError(f"{path} was built for genetic code {table.genetic_code}, not {code.table_id}")
+        return table
+    # reference genes are counted in frame from their first base, pairs with ambiguous bases are skipped
+    pairs = np.zeros(4096, dtype=np.int64)
+    codons = np.zeros(64, dtype=np.int64)
+    for _, seq in iter_fasta(path):
+        slots = analysis.codon_indices(seq)
+        pairs += pair_counts(slots)
+        codons += np.bincount(slots[slots < 64], minlength=64)
+    table = pair_table(pairs, codons, code)
+    table.info['source'] = os.path.basename(path)
+    table.save(os.path.join(output_dir, 'cps_table.json'))
+    return table
+
+"""
+Runs the analysis on every record of a fasta file
+Records are streamed from the file one at a time, for the comparison graphs only the 64 codon counts
+of each sequence are kept (GC3 and ENC are computed from them), so memory does not grow with the length of the sequences
+
+:param str sequence_file_name: fasta file (plain or gzip compressed), relative to this script's folder
+:param str output_folder_name: folder to save output graphs and files to
+:param bool single_only: True to calculate single sequence statistics for only the first sequence
+:param bool compare: True to generate RSCU heatmap, ENC, and ENC vs GC3 graphs comparing all sequences
+:param bool multi_only: True to only generate the comparison graphs
+:param str heatmap_title: title for RSCU heatmap
+:param list seq_names: labels for the sequences in the comparison graphs, names in the file are used if empty
+:param str enc_title: title for the ENC bar graph
+:param str enc_gc3_title: title for the ENC vs GC3 graph
+:param int workers: number of processes to analyze sequences in parallel, 1 to run them one after another
+:param int heatmap_max_rows: most rows drawn in the RSCU heatmap, None to draw every sequence
+:param str heatmap_reduce: 'group' or 'sample', how rows are picked when there are more sequences than heatmap_max_rows
+:param bool use_cache: True to reuse the codon counts and gc content of single sequence outputs stored in the cache file
+                       by earlier runs, False to recompute everything
+:param str cache_file: cache file, the output folder's stats_cache.sqlite if empty
+:param int cache_max_mb: size limit of the cache file in MB
+:param str plot_format: file format of the graphs ('png', 'svg'), None to only write statistics files
+:param int plot_dpi: resolution of the graphs
+:param str bulk_format: None to write statistics text files per sequence, 'tsv' or 'parquet' to write them
+                        for all sequences into a few tables (see bulk_output.BulkWriter)
+:param bool report_timing: True to save a summary of the time spent in each stage to timing.json (see timing.StageTimer)
+:param str profile: None, 'cprofile' or 'tracemalloc' to also profile each stage, this runs everything in one process
+:param bool genome_mode: True to analyze each record in chunks from the memory mapped file (see genome.MappedFasta)
+:param str cds_source: None to count codons over whole sequences, 'orf' to count the longest open reading frame of each,
+                       or a GFF / GenBank file (relative to this script's folder) with the CDS coordinates of each sequence
+:param str invalid_codons: 'raise' to fail sequences with codons containing an ambiguous or invalid base,
+                           'skip' to leave those codons out of the counts and report how many were skipped
+:param int genetic_code: NCBI translation table number (see genetic_codes.ncbi_tables)
+:param str enc_method: 'wright' or 'novembre', see analysis.enc_values
+:param str cai_reference: fasta file of reference coding sequences, or a saved CAI weight table (.json), None to skip CAI
+:param str trna_counts: tRNA gene copy number file (see adaptation.read_trna_counts), or a saved tAI weight table (.json),
+                        None to skip tAI
+:param int codon_window: number of codons per window of the local codon usage tracks of each single analyzed
+                         sequence (see windows.codon_window_tracks), None to skip them
+:param int codon_window_step: distance between the starts of consecutive windows, in codons
+:param str heatmap_order: 'input' or 'cluster', row order of the RSCU heatmap (see plotting.rscu_heatmap), clustered
+                          with distance_metric (euclidean if None) like codon_usage_structure.tsv
+:param str distance_metric: None, or the metric of the distances between the RSCU of the compared sequences
+                            (see distance.distance_matrix) to save with their clustering and ordination
+:param str fasta_parser: 'native' or 'biopython', see fasta.read_fasta
+:param str cpb_reference: fasta file of reference coding sequences, or saved codon pair scores (.json), None to skip
+                          the codon pair bias
+:return: (name, error message) for every record that failed
+:rtype: list
+"""
+def run(sequence_file_name: str, output_folder_name: str, single_only=True, compare=False, multi_only=True,
+        heatmap_title='', seq_names=None, enc_title='', enc_gc3_title='', workers=1,
+        heatmap_max_rows=None, heatmap_reduce='group', use_cache=False, cache_file='', cache_max_mb=1024,
+        plot_format='png', plot_dpi=300, bulk_format=None, report_timing=False, profile=None,
+        genome_mode=False, cds_source=None, invalid_codons='raise', genetic_code=1, enc_method='wright',
+        cai_reference=None, trna_counts=None, codon_window=None, codon_window_step=10, heatmap_order='cluster',
+        distance_metric=None, fasta_parser='native', cpb_reference=None):
+    start_time = time.perf_counter()
+    timer = StageTimer(profile)
+    if profile is not None and workers > 1:
+        print("Profiling only covers this process, running with workers = 1")
+        workers = 1
+
+    # read file
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    file_name = os.path.join(script_dir, sequence_file_name)
+
+    # fails early on an unknown table number
+    code = get_genetic_code(genetic_code)
+    if invalid_codons not in ('raise', 'skip'):
+        raise ValueError(f"invalid_codons must be 'raise' or 'skip', not {invalid_codons!r}")
+
+    # coding sequences of each record, keys are sequence ids
+    annotations = None
+    if cds_source is not None and genome_mode:
+        raise ValueError("cds_source can not be used in whole genome mode")
+    if codon_window is not None and genome_mode:
+        raise ValueError("codon_window can not be used in whole genome mode")
+    if cpb_reference is not None and genome_mode:
+        raise ValueError("cpb_reference can not be used in whole genome mode")
+    if cds_source is not None and cds_source != 'orf':
+        annotations = orf.read_cds_annotations(os.path.join(script_dir, cds_source))
+
+    # directories to save things to
+    output_dir = output_folder_name
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if use_cache and not cache_file:
+        cache_file = os.path.join(output_dir, 'stats_cache.sqlite')
+    if not use_cache or genome_mode:
+        cache_file = None
+    cache_max_bytes = cache_max_mb * 1024**2
+
+    # adaptation weight tables, built once per run (or loaded from an earlier run's .json) and used to score every sequence
+    weight_tables = {}
+    if cai_reference is not None:
+        with timer.stage('weights'):
+            weight_tables['cai'] = load_adaptation_weights(os.path.join(script_dir, cai_reference), 'cai', code, output_dir)
+    if trna_counts is not None:
+        with timer.stage('weights'):
+            weight_tables['tai'] = load_adaptation_weights(os.path.join(script_dir, trna_counts), 'tai', code, output_dir)
+    pair_scores = None
+    if cpb_reference is not None:
+        with timer.stage('weights'):
+            pair_scores = load_pair_scores(os.path.join(script_dir, cpb_reference), code, output_dir)
+
+    # the codon counts of every record are kept for the comparison graphs and the adaptation scores
+    summarize = compare or bool(weight_tables) or pair_scores is not None
+
+    tot = 1
+    if not single_only:
+        tot = None      # calculate stats for all sequences
+    if multi_only:
+        tot = 0
+
+    # per sequence summaries needed by the comparison graphs and adaptation scores, keys are the record's position in the file
+    names = {}
+    summaries = {}
+    cpb = {}
+    failed = []
+    used_names = {}
+    processed = 0
+
+    bulk_writer = None
+    if bulk_format is not None:
+        bulk_writer = BulkWriter(output_dir, bulk_format, 30, code=code, enc_method=enc_method)
+    # results waiting for earlier records to finish, so bulk rows are written in file order
+    bulk_pending = {}
+    bulk_next = 0
+
+    # keeps the result of one record and reports progress
+    def collect(i, seq_name, single, result):
+        nonlocal processed, bulk_next
+        processed += 1
+        stats, error, timings = result
+        if timings is not None:
+            timer.merge(timings)
+        if error is not None:
+            failed.append((seq_name, error))
+            print(f"Failed to analyze {seq_name}: {error}")
+        elif summarize:
+            names[i] = seq_name
+            summaries[i] = stats['codon_counts']
+            if 'cpb' in stats:
+                cpb[i] = stats['cpb']
+        skipped = stats.get('invalid_codons') if error is None else None
+        note = f" ({skipped} codons with ambiguous bases skipped)" if skipped else ''
+        print(f"[{processed} done, {len(failed)} failed] {seq_name}{note}")
+
+        if bulk_writer is not None:
+            bulk_pending[i] = (seq_name, stats if single and error is None else None)
+            while bulk_next in bulk_pending:
+                name, stats = bulk_pending.pop(bulk_next)
+                if stats is not None:
+                    with timer.stage('bulk_write'):
+                        bulk_writer.add(name, stats)
+                bulk_next += 1
+
+    # open file as fasta and go through it one record at a time
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        pool = ProcessPoolExecutor(max_workers=workers)
+        pending = {}
+    if genome_mode:
+        # records are read from the mapped file by name, in the worker that analyzes them
+        records = ((entry.name, entry.name) for entry in get_mapped_fasta(file_name).entries)
+    else:
+        records = read_fasta(file_name, fasta_parser)
+    # settings shared by every record, passed to process_record by keyword
+    record_options = {
+        'output_dir': output_dir,
+        'compare': summarize,
+        'cache_file': cache_file,
+        'cache_max_bytes': cache_max_bytes,
+        'plot_format': plot_format,
+        'dpi': plot_dpi,
+        'write_text': bulk_writer is None,
+        'genome_file': file_name if genome_mode else None,
+        'invalid': invalid_codons,
+        'genetic_code': genetic_code,
+        'codon_window': codon_window,
+        'codon_window_step': codon_window_step,
+        'enc_method': enc_method,
+        'pair_table': pair_scores,
+    }
+    for i, (seq_name, seq) in enumerate(timed_records(records, timer)):
+        if tot is not None and i >= tot and not summarize:
+            break   # nothing else needs the rest of the file
+
+        single = tot is None or i < tot
+        cds = cds_source if annotations is None else annotations.get(seq_name, [])
+        # the same de-duplicated name is used for the output files, the tables and the graph labels
+        seq_name = unique_filename(seq_name, used_names)
+
+        if workers == 1:
+            collect(i, seq_name, single, process_record(seq_name, seq, single=single, timer=timer, cds=cds,
+                                                          **record_options))
+            continue
+
+        # only keep a few records per worker in flight so the file is still streamed
+        if len(pending) >= 2 * workers:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(*pending.pop(future), future.result())
+        pending[pool.submit(process_record, seq_name, seq, single=single, cds=cds,
+                            **record_options)] = (i, seq_name, single)
+
+    if workers > 1:
+        for future in wait(pending).done:
+            collect(*pending[future], future.result())
+        pool.shutdown()
+    if cache_file:
+        # last used times of this process's cache hits, the worker processes store theirs when they exit
+        flush_caches()
+
+    if bulk_writer is not None:
+        with timer.stage('bulk_write') as written:
+            bulk_writer.close()
+            written['bytes'] += sum(os.path.getsize(path) for path in bulk_writer.paths.values())
+            written['bytes'] += os.path.getsize(os.path.join(output_dir, 'gc_profiles.u16'))
+
+    if (weight_tables or pair_scores is not None) and summaries:
+        with timer.stage('adaptation') as written:
+            order = sorted(summaries)
+            counts = np.vstack([summaries[i] for i in order])
+            # one matrix product per index for all sequences
+            scores = {kind: table.score(counts) for kind, table in weight_tables.items()}
+            if pair_scores is not None:
+                scores['cpb'] = np.array([cpb[i] for i in order])
+            output_filename = os.path.join(output_dir, 'adaptation_scores.tsv')
+            with open(output_filename, 'w') as file:
+                file.write('\t'.join(['name', *scores]) + '\n')
+                for row, i in enumerate(order):
+                    file.write('\t'.join([names[i], *(f'{values[row]:.4f}' for values in scores.values())]) + '\n')
+            written['bytes'] += os.path.getsize(output_filename)
+
+    leaves = None   # clustering order of the sequences, when it is computed
+    if compare and distance_metric is not None and summaries:
+        with timer.stage('distances') as written:
+            order = sorted(summaries)
+            structure_names = [seq_names[i] for i in order] if seq_names else [names[i] for i in order]
+            counts = np.vstack([summaries[i] for i in order])
+            # N x N float32 written block by block straight to the .npy file
+            output_filename = os.path.join(output_dir, 'codon_distances.npy')
+            distances = np.lib.format.open_memmap(output_filename, mode='w+', dtype=np.float32,
+                                                  shape=(len(order), len(order)))
+            profiles = codon_profiles(counts, 'rscu', code)
+            distance_matrix(profiles, distance_metric, distances)
+            distances.flush()
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # the clustering needs an N x N float32 copy in memory, past linkage_max_bytes the column is left empty
+            rank = [''] * len(order)
+            if distances.nbytes <= linkage_max_bytes:
+                leaves = leaf_order(linkage(distances))
+                for position, row in enumerate(leaves):
+                    rank[row] = position
+            else:
+                print(f"Too many sequences to cluster in memory ({len(order)}), cluster_order is left empty")
+            pc, _ = pca(profiles, 2)
+            ca, _, _ = correspondence_analysis(counts, 2)
+            # fewer axes than 2 with a single sequence
+            pc, ca = (np.pad(axes, ((0, 0), (0, 2 - axes.shape[1]))) for axes in (pc, ca))
+            output_filename = os.path.join(output_dir, 'codon_usage_structure.tsv')
+            with open(output_filename, 'w') as file:
+                file.write('name\tcluster_order\tpc1\tpc2\tca1\tca2\n')
+                for row, name in enumerate(structure_names):
+                    values = [*pc[row], *ca[row]]
+                    file.write(f'{name}\t{rank[row]}\t' + '\t'.join(f'{value:.6g}' for value in values) + '\n')
+            written['bytes'] += os.path.getsize(output_filename)
+
+    plotting = load_plotting(plot_format, plot_dpi) if compare else None
+    if plotting and summaries:
+        with timer.stage('compare') as written:
+            order = sorted(summaries)
+            if seq_names:
+                names = [seq_names[i] for i in order]
+            else:
+                names = [names[i] for i in order]
+            # N x 64 codon count matrix shared by all comparison graphs
+            counts = np.vstack([summaries[i] for i in order])
+
+            # rscu heatmap, clustered like codon_usage_structure.tsv when the distances were computed
+            output_filename = os.path.join(output_dir, f'RSCU_heatmap.{plot_format}')
+            row_order = leaves if heatmap_order == 'cluster' and leaves is not None else heatmap_order
+            plotting.rscu_heatmap(names, counts, heatmap_title, output_filename, heatmap_max_rows, heatmap_reduce, code,
+                                  row_order, distance_metric or 'euclidean')
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # plot all enc values
+            output_filename = os.path.join(output_dir, f'ENC_values.{plot_format}')
+            plotting.enc(names, counts, enc_title, output_filename, code, enc_method)
+            written['bytes'] += os.path.getsize(output_filename)
+
+            # enc vs gc3
+            output_filename = os.path.join(output_dir, f'ENC_vs_GC3.{plot_format}')
+            plotting.enc_vs_gc3(names, counts, enc_gc3_title, output_filename, code, enc_method)
+            written['bytes'] += os.path.getsize(output_filename)
+
+    if report_timing or profile is not None:
+        timer.dump(output_dir, time.perf_counter() - start_time)
+
+    if failed:
+        print(f"{len(failed)} sequence(s) failed: " + ', '.join(name for name, _ in failed))
+    return failed
+
+if __name__ == '__main__':
+    run(sequence_file_name, output_folder_name, single_only=single_only, compare=compare, multi_only=multi_only,
+        heatmap_title=heatmap_title, seq_names=seq_names, enc_title=enc_title, enc_gc3_title=enc_gc3_title,
+        workers=workers, heatmap_max_rows=heatmap_max_rows, heatmap_reduce=heatmap_reduce, use_cache=use_cache,
+        cache_file=cache_file, cache_max_mb=cache_max_mb, plot_format=plot_format, plot_dpi=plot_dpi,
+        bulk_format=bulk_format, report_timing=report_timing, profile=profile, genome_mode=genome_mode,
+        cds_source=cds_source, invalid_codons=invalid_codons, genetic_code=genetic_code, enc_method=enc_method,
+        cai_reference=cai_reference, trna_counts=trna_counts, codon_window=codon_window,
+        codon_window_step=codon_window_step, heatmap_order=heatmap_order, distance_metric=distance_metric,
+        fasta_parser=fasta_parser, cpb_reference=cpb_reference)
@@ -0,0 +1,282 @@
+# coding sequence (CDS) handling: finds open reading frames on both strands, reads CDS coordinates from
+# GFF / GenBank files, and counts codons over CDS spans only
+# a CDS is (parts, strand): parts is a list of (start, end) base ranges (0 based, end excluded, in forward strand
+# coordinates, in increasing order) that are joined to make the coding sequence, strand is 1 or -1
+import numpy as np
+import analysis
+from genetic_codes import get_genetic_code
+
+# base code of the complementary base (U/T <-> A, C <-> G), invalid bases (64) stay invalid
+complement_codes = np.full(65, 64, dtype=np.uint8)
+complement_codes[:4] = [2, 3, 0, 1]
+
+"""
+Converts a sequence to its 2 bit base codes (see analysis.base_codes)
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:return: one code per base
+:rtype: numpy.ndarray
+"""
+def base_code_array(sequence):
+    return analysis.base_codes[np.frombuffer(analysis.sequence_bytes(sequence), dtype=np.uint8)]
+
+"""
+Computes the slot of the codon starting at every position of a sequence, on both strands
+
+:param numpy.ndarray codes: base codes (see base_code_array)
+:return: (forward, reverse), forward[p] is the slot of bases p..p+2, reverse[p] the slot of their reverse complement,
+         64 if the codon contains an invalid base
+:rtype: tuple
+"""
+def position_slots(codes):
+    if len(codes) < 3:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    codes = codes.astype(np.intp)
+    forward = np.minimum(4 * codes[:-2] + 16 * codes[1:-1] + codes[2:], 64)
+    comp = complement_codes.astype(np.intp)[codes]
+    reverse = np.minimum(4 * comp[2:] + 16 * comp[1:-1] + comp[:-2], 64)
+    return forward, reverse
+
+"""
+Finds the open reading frames (start codon to the next in frame stop codon) of all six frames in one pass
+For each stop codon only the longest ORF (from the first start codon after the previous stop) is kept,
+ORFs that run off the end of the sequence without a stop codon are not reported
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param int min_codons: shortest ORF to report, in codons including the stop codon
+:param start_codons: codons that can start an ORF, None for all start codons of the genetic code
+:param GeneticCode code: genetic code that decides which codons are stops (see genetic_codes), None for the standard code
+:return: ORFs as CDS tuples ([(start, end)], strand), the stop codon is included, longest first
+:rtype: list
+"""
+def find_orfs(sequence, min_codons: int = 100, start_codons=('AUG',), code=None):
+    forward, reverse = position_slots(base_code_array(sequence))
+    code = get_genetic_code(1 if code is None else code)
+    if start_codons is None:
+        start_slots = code.start_mask
+    else:
+        start_slots = np.zeros(65, dtype=bool)
+        start_slots[[analysis.codon_list.index(codon) for codon in start_codons]] = True
+
+    orfs = []
+    for strand, slots in ((1, forward), (-1, reverse)):
+        starts = np.flatnonzero(start_slots[slots])
+        stops = np.flatnonzero(code.stop_mask[slots])
+        for frame in range(3):
+            frame_starts = starts[starts % 3 == frame]
+            frame_stops = stops[stops % 3 == frame]
+            if strand == 1:
+                # first stop after each start, the earliest start of each stop gives the longest ORF
+                nxt = np.searchsorted(frame_stops, frame_starts)
+                keep = nxt < len(frame_stops)
+                stop_of, first = np.unique(nxt[keep], return_index=True)
+                begin = frame_starts[keep][first]
+                end = frame_stops[stop_of] + 3
+            else:
+                # the reverse strand is read from right to left: the stop is the last one before the start
+                nxt = np.searchsorted(frame_stops, frame_starts) - 1
+                keep = nxt >= 0
+                stop_of, last = np.unique(nxt[keep][::-1], return_index=True)
+                begin = frame_stops[stop_of]
+                end = frame_starts[keep][::-1][last] + 3
+            long_enough = (end - begin) // 3 >= min_codons
+            orfs.extend(([(int(b), int(e))], strand) for b, e in zip(begin[long_enough], end[long_enough]))
+    orfs.sort(key=lambda orf: orf[0][0][0] - orf[0][0][1])
+    return orfs
+
+"""
+Finds the longest open reading frame on either strand (see find_orfs), for example the CDS of an mRNA
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param int min_codons: shortest ORF to accept, in codons including the stop codon
+:param GeneticCode code: genetic code that decides which codons are stops, None for the standard code
+:return: the ORF as a CDS tuple ([(start, end)], strand), or None if there is none
+:rtype: tuple
+"""
+def longest_orf(sequence, min_codons: int = 1, code=None):
+    orfs = find_orfs(sequence, min_codons, code=code)
+    return orfs[0] if orfs else None
+
+"""
+Collects the base codes of the codons of one CDS in reading order
+A single part is used as a view of codes, only CDS made of several parts are gathered into a new array
+
+:param numpy.ndarray codes: base codes of the whole sequence (see base_code_array)
+:param tuple cds: (parts, strand)
+:return: n_codons x 3 base codes, reverse complemented for the reverse strand
+:rtype: numpy.ndarray
+"""
+def cds_codon_codes(codes, cds):
+    parts, strand = cds
+    if len(parts) == 1:
+        bases = codes[parts[0][0]:parts[0][1]]
+    else:
+        bases = codes[np.concatenate([np.arange(start, end) for start, end in parts])]
+    n_codons = len(bases) // 3
+    if strand == 1:
+        return bases[:n_codons * 3].reshape(n_codons, 3)
+    # reading the reverse strand: the last base of the part comes first, complemented
+    return complement_codes[bases[len(bases) - n_codons * 3:][::-1]].reshape(n_codons, 3)
+
+"""
+Counts each codon in the coding sequences of a sequence, the rest of the sequence is not counted
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds_list: CDS tuples (parts, strand)
+:return: 65 counts summed over all CDS, index i < 64 is the count of codon_list[i],
+         index 64 the number of codons with an invalid base (see analysis.codon_tally)
+:rtype: numpy.ndarray
+"""
+def cds_codon_tally(sequence, cds_list):
+    codes = base_code_array(sequence)
+    tally = np.zeros(65, dtype=np.int64)
+    for cds in cds_list:
+        counts = np.bincount(cds_codon_codes(codes, cds) @ analysis.codon_slot_weights, minlength=65)
+        tally[:64] += counts[:64]
+        tally[64] += counts[64:].sum()
+    return tally
+
+"""
+Finds the first codon of the coding sequences that contains an invalid base
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds_list: CDS tuples (parts, strand)
+:return: the codon (upper case rna, invalid bases as N), or None if every codon is valid
+:rtype: str
+"""
+def first_invalid_codon(sequence, cds_list):
+    codes = base_code_array(sequence)
+    for cds in cds_list:
+        codon_codes = cds_codon_codes(codes, cds)
+        idx = codon_codes @ analysis.codon_slot_weights
+        if len(idx) and idx.max() > 63:
+            return ''.join('UCAG'[code] if code < 4 else 'N' for code in codon_codes[np.argmax(idx > 63)])
+    return None
+
+"""
+Computes the number of each codon in the coding sequences of a sequence, the rest of the sequence is not counted
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds_list: CDS tuples (parts, strand)
+:param str invalid: 'raise' or 'skip', see analysis.codon_counts
+:return: codon counts summed over all CDS, index i is the count of codon_list[i]
+:rtype: numpy.ndarray
+"""
+def cds_codon_counts(sequence, cds_list, invalid: str = 'raise'):
+    if invalid not in ('raise', 'skip'):
+        raise ValueError(f"invalid must be 'raise' or 'skip', not {invalid!r}")
+    tally = cds_codon_tally(sequence, cds_list)
+    if tally[64] and invalid == 'raise':
+        # same error as analysis.codon_counts
+        raise KeyError(first_invalid_codon(sequence, cds_list))
+    return tally[:64]
+
+"""
+Computes the GC content of codon positions 1 and 2 together, and of codon position 3, over the coding sequences only
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds_list: CDS tuples (parts, strand)
+:return: (gc12, gc3) as percentages rounded like analysis.gc, 0 if the CDS hold no complete codon (like
+         analysis.gc3_values)
+:rtype: tuple
+"""
+def cds_gc_positions(sequence, cds_list):
+    codes = base_code_array(sequence)
+    gc_per_position = np.zeros(3, dtype=np.int64)
+    n_codons = 0
+    for cds in cds_list:
+        codon_codes = cds_codon_codes(codes, cds)
+        # C and G have odd codes, invalid bases (64) are even
+        gc_per_position += (codon_codes & 1).sum(axis=0, dtype=np.int64)
+        n_codons += len(codon_codes)
+    if not n_codons:
+        return 0.0, 0.0
+    gc12 = round(int(gc_per_position[:2].sum()) / (2 * n_codons) * 100, 4)
+    gc3 = round(int(gc_per_position[2]) / n_codons * 100, 4)
+    return gc12, gc3
+
+"""
+Trims the bases before the first complete codon of a CDS (GFF phase / GenBank codon_start - 1)
+
+:param list parts: (start, end) ranges in increasing order
+:param int strand: 1 or -1
+:param int phase: number of bases to skip at the start of the CDS in reading order
+:return: the trimmed parts
+:rtype: list
+"""
+def trim_phase(parts, strand: int, phase: int):
+    if not phase:
+        return parts
+    parts = list(parts)
+    if strand == 1:
+        parts[0] = (parts[0][0] + phase, parts[0][1])
+    else:
+        parts[-1] = (parts[-1][0], parts[-1][1] - phase)
+    return parts
+
+"""
+Reads the CDS features of a GFF3 file, the rows of one CDS (same Parent, or same ID) are joined
+
+:param str file_name: path to the GFF file
+:return: CDS tuples per sequence id, in file order
+:rtype: dict
+"""
+def read_gff_cds(file_name: str):
+    # (seqid, group) -> [parts, strand, phase of the first part in reading order]
+    features = {}
+    with open(file_name) as file:
+        for line in file:
+            if line.startswith('##FASTA'):
+                break
+            if line.startswith('#') or not line.strip():
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9 or fields[2] != 'CDS':
+                continue
+            attributes = dict(item.split('=', 1) for item in fields[8].split(';') if '=' in item)
+            group = attributes.get('Parent', attributes.get('ID', str(len(features))))
+            strand = -1 if fields[6] == '-' else 1
+            phase = int(fields[7]) if fields[7] in ('0', '1', '2') else 0
+            # GFF coordinates are 1 based and include the end
+            part = (int(fields[3]) - 1, int(fields[4]))
+            feature = features.setdefault((fields[0], group), [[], strand, None])
+            feature[0].append((part, phase))
+
+    cds = {}
+    for (seqid, _), (parts, strand, _) in features.items():
+        parts.sort()
+        first = parts[0] if strand == 1 else parts[-1]
+        cds.setdefault(seqid, []).append((trim_phase([part for part, _ in parts], strand, first[1]), strand))
+    return cds
+
+"""
+Reads the CDS features of a GenBank file
+
+:param str file_name: path to the GenBank file
+:return: CDS tuples per record id, in file order
+:rtype: dict
+"""
+def read_genbank_cds(file_name: str):
+    from Bio import SeqIO   # imported here so importing this module stays fast
+    cds = {}
+    for record in SeqIO.parse(file_name, 'genbank'):
+        for feature in record.features:
+            if feature.type != 'CDS':
+                continue
+            strand = -1 if feature.location.strand == -1 else 1
+            parts = sorted((int(part.start), int(part.end)) for part in feature.location.parts)
+            phase = int(feature.qualifiers.get('codon_start', ['1'])[0]) - 1
+            cds.setdefault(record.id, []).append((trim_phase(parts, strand, phase), strand))
+    return cds
+
+"""
+Reads the CDS features of a GFF (.gff, .gff3) or GenBank (.gb, .gbk, .genbank) file
+
+:param str file_name: path to the annotation file
+:return: CDS tuples per sequence id
+:rtype: dict
+"""
+def read_cds_annotations(file_name: str):
+    if file_name.lower().endswith(('.gb', '.gbk', '.gbff', '.genbank')):
+        return read_genbank_cds(file_name)
+    return read_gff_cds(file_name)
@@ -1,8 +1,58 @@
 # creates plots to visualize data
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
+import matplotlib
+matplotlib.use('Agg')   # plots are only saved to files, never shown, so use the non interactive backend
+from matplotlib.figure import Figure
+import numpy as np
 import analysis
+import distance
+# seaborn and pandas are only needed for the heatmap and take long to import, so they are imported in rscu_heatmap
+
+# settings used to save every plot, change them with configure()
+render = {'dpi': 300, 'format': 'png'}
+
+# widest gc distribution figure in inches, longer sequences are downsampled to its pixel width instead of widening it
+gc_max_width = 30
+
+# one figure per plot type, cleared and redrawn on every call instead of building a new figure each time
+figures = {}
+
+"""
+Sets how plots are saved
+
+:param int dpi: resolution of saved plots
+:param str fmt: 'png', 'svg' (or any other format matplotlib can save), None to not draw or save any plots
+"""
+def configure(dpi: int = 300, fmt='png'):
+    render['dpi'] = dpi
+    render['format'] = fmt
+
+"""
+Returns the figure kept for a plot type, cleared and resized, creating it the first time
+
+:param str kind: plot type, for example 'rscu'
+:param tuple figsize: (width, height) in inches
+:return: empty figure
+:rtype: matplotlib.figure.Figure
+"""
+def get_figure(kind: str, figsize):
+    fig = figures.get(kind)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        figures[kind] = fig
+    else:
+        fig.clf()
+        fig.set_size_inches(figsize)
+    return fig
+
+"""
+Saves a figure with the current render settings
+
+:param fig: figure to save
+:param str filename: file name for plot to be saved to
+:param kwargs: other arguments for savefig, for example bbox_inches='tight'
+"""
+def save(fig, filename: str, **kwargs):
+    fig.savefig(filename, dpi=render['dpi'], format=render['format'], **kwargs)
 
 """
 Generate and saves a sorted usage (count and frequency) bar plot
@@ -13,13 +63,17 @@ Generate and saves a sorted usage (count and frequency) bar plot
 :param str output_filename: file name for plot to be saved to
 """
 def bar_count_freq(data: dict, title: str, x_label: str, output_filename: str):
+    if render['format'] is None:
+        return
+
     # sorting data and calculating frequency fractions
     sorted_data = sorted(data.items(), key=lambda item: item[1], reverse=True)
     labels, count = zip(*sorted_data)
     freq = tuple(x / sum(data.values()) for x in count)
 
     # plotting
-    fig, ax1 = plt.subplots(figsize=(12, 6))
+    fig = get_figure('bar_count_freq', (12, 6))
+    ax1 = fig.subplots()
     fig.suptitle(title, fontsize=14)
 
     # bar plot for count
@@ -38,13 +92,43 @@ def bar_count_freq(data: dict, title: str, x_label: str, output_filename: str):
     ax1.set_xticks(range(len(labels)))
     ax1.set_xticklabels(labels, fontsize=9, rotation=45, ha='right')
 
-    plt.tight_layout()
+    fig.tight_layout()
 
-    # save figure and close plot
-    plt.savefig(output_filename, dpi=300) 
-    plt.close()
+    # save figure
+    save(fig, output_filename)
     print(f"Bar chart saved to {output_filename}")
 
+"""
+Reduces a profile to the smallest and largest value of each bucket, kept in position order, so a line through
+the points looks the same as one through every value at the given width (peaks and dips are never averaged away)
+The profile is read a slice at a time, so it can be a memory mapped array larger than memory
+
+:param data: one value per window, any numpy array (for example a numpy.memmap)
+:param int n_buckets: number of buckets, for example the pixel width of the plot
+:param int step: distance between the starts of consecutive windows
+:return: (x, y), x are 1 based base positions, at most 2 * n_buckets points, data is returned as is if it is not longer
+:rtype: tuple
+"""
+def minmax_downsample(data, n_buckets: int, step: int = 1):
+    n = len(data)
+    if n <= 2 * n_buckets:
+        return np.arange(1, n * step + 1, step), np.asarray(data)
+    bucket = -(-n // n_buckets)
+    # whole buckets per slice, about 1M values at a time
+    slice_size = max(1024**2 // bucket, 1) * bucket
+    index = []
+    for start in range(0, n, slice_size):
+        values = np.asarray(data[start:start + slice_size])
+        pad = -len(values) % bucket
+        if pad:
+            # the last bucket is filled up with its last value, argmin / argmax find the real one first
+            values = np.concatenate((values, np.repeat(values[-1:], pad)))
+        rows = values.reshape(-1, bucket)
+        pair = np.sort(np.stack((rows.argmin(axis=1), rows.argmax(axis=1)), axis=1), axis=1)
+        index.append((pair + np.arange(start, start + len(values), bucket)[:, None]).ravel())
+    index = np.unique(np.concatenate(index))
+    return index * step + 1, np.asarray(data[index])
+
 """
 Generate and saves a GC content distribution line graph, and a bar graph to compare 
 
@@ -52,57 +136,83 @@ Generate and saves a GC content distribution line graph, and a bar graph to comp
 :param int window_size: size of window around each base, >=30 and <len(sequence)
 :param str lineplot_filename: file name for line plot to be saved to
 :param str bar_filename: file name for bar graph to be saved to
+:param int step: distance between the starts of consecutive windows (default 1, every base)
 :return: GC distribution line graph values
-:rtype: list
+:rtype: numpy.ndarray
 """
-def gc(sequence: str, window_size: int, lineplot_filename: str, bar_filename: str):
-    # maybe raise errors for issues with sequence length, window size
-    # compute windows
-    data = []
-    for i in range(0, len(sequence) - window_size):
-        # for any bp, gc content to be graphed = gc content of window from the bp to i + window_size
-        data.append(analysis.gc(sequence[i:i+window_size]))
+def gc(sequence: str, window_size: int, lineplot_filename: str, bar_filename: str, step: int = 1):
+    # for any bp, gc content to be graphed = gc content of window from the bp to i + window_size
+    data = analysis.gc_profile(sequence, window_size, step)
+    gc_distribution(data, len(sequence), lineplot_filename, step)
 
-    # plotting
-    x = list(range(1, len(sequence) - window_size + 1))
+    gc12, gc3 = analysis.gc_codon_positions(sequence)
+    gc_positions(analysis.gc(sequence), gc12, gc3, bar_filename)
+
+    return data
+
+"""
+Generate and saves a GC content distribution line graph from an already computed profile
+The figure widens with the sequence up to gc_max_width inches, longer profiles are reduced to the figure's pixel
+width (see minmax_downsample) so drawing time and memory stay bounded
+
+:param data: gc content of each window (see analysis.gc_profile), or g/c counts if window_size is given
+:param int sequence_length: length of the sequence the profile was computed from
+:param str lineplot_filename: file name for line plot to be saved to
+:param int step: distance between the starts of consecutive windows
+:param int window_size: None if data are percentages, else the window size of the g/c counts in data
+                        (see analysis.gc_window_counts), they are converted after downsampling
+"""
+def gc_distribution(data, sequence_length: int, lineplot_filename: str, step: int = 1, window_size=None):
+    if render['format'] is None:
+        return
 
-    plt.rcParams.update({'font.size': 15}) 
     # widen plot for longer sequences
-    add_width = int(len(sequence) / 500)
-    plt.figure(figsize=(8 + add_width, 6))
-    plt.plot(x, data)
-    plt.xlabel('Base Index')
-    plt.xlim(1, len(x))
-    plt.ylabel('GC Content (%)')
-    plt.title('GC Content Distribution')
-
-    # save figure and close plot
-    plt.savefig(lineplot_filename, dpi=300, bbox_inches='tight') 
-    plt.close()
+    width = min(8 + int(sequence_length / 500), gc_max_width)
+    x, y = minmax_downsample(data, int(width * render['dpi']), step)
+    if window_size is not None:
+        y = analysis.gc_window_percent(y, window_size)
+
+    with matplotlib.rc_context({'font.size': 15}):
+        fig = get_figure('gc_distribution', (width, 6))
+        ax = fig.subplots()
+        ax.plot(x, y)
+        ax.set_xlabel('Base Index')
+        ax.set_xlim(1, len(data) * step)
+        ax.set_ylabel('GC Content (%)')
+        ax.set_title('GC Content Distribution')
+
+        # save figure
+        save(fig, lineplot_filename, bbox_inches='tight')
     print(f"Line plot saved to {lineplot_filename}")
 
-    # plotting average GC content of bp 1 and 2 vs 3 in codons
+"""
+Generate and saves a bar graph of the average GC content of codon positions 1 and 2 vs 3
+
+:param float gc_all: gc content of the whole sequence (see analysis.gc)
+:param float gc12: gc content of codon positions 1 and 2 (see analysis.gc_codon_positions)
+:param float gc3: gc content of codon position 3
+:param str bar_filename: file name for bar graph to be saved to
+"""
+def gc_positions(gc_all: float, gc12: float, gc3: float, bar_filename: str):
+    if render['format'] is None:
+        return
+
     bp = ['1 and 2', '3']
-    gc_all = analysis.gc(sequence)
-    gc12 = analysis.gc(sequence[0::3] + sequence[1::3])
-    gc3 = analysis.gc(sequence[2::3])
-
-    plt.rcParams.update({'font.size': 14}) 
-    fig, ax = plt.subplots(figsize=(6, 6))
-    bars = ax.bar(bp, [gc12, gc3])
-    ax.bar_label(bars, fmt='%.2f')
-
-    ax.set_xlabel('Codon Position')
-    ax.set_ylabel('GC Content (%)')
-    ax.set_ylim(0, max(gc12, gc3) * 1.1) # add 10% headroom to bars for labels
-    ax.set_title(f'Overall Average GC Content: {gc_all:.2f}')
-
-    # save figure and close plot
-    fig.savefig(bar_filename, dpi=300) 
-    plt.close()
-    print(f"Bar plot saved to {bar_filename}")
 
-    return data
+    with matplotlib.rc_context({'font.size': 14}):
+        fig = get_figure('gc_positions', (6, 6))
+        ax = fig.subplots()
+        bars = ax.bar(bp, [gc12, gc3])
+        ax.bar_label(bars, fmt='%.2f')
+
+        ax.set_xlabel('Codon Position')
+        ax.set_ylabel('GC Content (%)')
+        ax.set_ylim(0, max(gc12, gc3) * 1.1) # add 10% headroom to bars for labels
+        ax.set_title(f'Overall Average GC Content: {gc_all:.2f}')
+
+        # save figure
+        save(fig, bar_filename)
+    print(f"Bar plot saved to {bar_filename}")
 
 """
 Generate and saves a graph comparing rscu values
@@ -111,22 +221,25 @@ Generate and saves a graph comparing rscu values
 :param str filename: file name for graph to be saved to
 """
 def rscu(rscu_data, filename):
+    if render['format'] is None:
+        return
+
     x = list(rscu_data.keys())
     y = list(rscu_data.values())
 
-    plt.figure(figsize=(12,6))
-    plt.rcParams.update({'font.size': 15}) 
-    plt.bar(x, y)
-    plt.xlabel('Codon')
-    plt.ylabel('RSCU')
+    with matplotlib.rc_context({'font.size': 15}):
+        fig = get_figure('rscu', (12, 6))
+        ax = fig.subplots()
+        ax.bar(x, y)
+        ax.set_xlabel('Codon')
+        ax.set_ylabel('RSCU')
 
-    plt.xticks(fontsize=9, rotation=45)
-    plt.tight_layout()
-    plt.margins(x=0.01)
+        ax.tick_params(axis='x', labelsize=9, labelrotation=45)
+        fig.tight_layout()
+        ax.margins(x=0.01)
 
-    # save figure and close plot
-    plt.savefig(filename, dpi=300) 
-    plt.close()
+        # save figure
+        save(fig, filename)
     print(f"RSCU plot saved to {filename}")
 
 """
@@ -135,32 +248,84 @@ X-axis = codons
 Y-axis = different genes/organisms
 Color = RSCU
 
+If there are more sequences than max_rows, the heatmap only draws max_rows rows so it stays readable
+and fast to render: either evenly spaced sequences ('sample') or the average RSCU of groups of
+similar sequences ('group', labelled with the first sequence of the group and the number of other sequences in it),
+and the title says how many sequences the rows stand for
+
 :param list names: names of the sequences (row labels)
-:param list seqs: sequences to be analyzed
+:param codon_counts: N x 64 codon count matrix, one row per sequence (see analysis.codon_count_matrix)
 :param str title: title for the heatmap
 :param str filename: file name for plot to be saved to
+:param int max_rows: maximum number of rows to draw, None to draw every sequence
+:param str reduce: 'sample' or 'group', how to pick the rows when there are more than max_rows sequences
+:param GeneticCode code: genetic code to group synonymous codons by (see genetic_codes), None for the standard code
+:param order: 'input' to draw the rows in input order, 'cluster' to put rows with similar RSCU next to each other
+              (average linkage clustering of their distances, see distance.cluster_order), or the row order
+              already computed for all sequences (see distance.leaf_order), the drawn rows are clustered instead
+              if they are reduced
+:param str metric: distance metric of the clustering, see distance.distance_matrix
 """
-def rscu_heatmap(names, seqs, title, filename):
-    data = pd.DataFrame()
-    for i in range(len(names)):
-        codon_use = analysis.analyze_codons(seqs[i])
-        aa_use = analysis.analyze_amino_acids(codon_use)
-        rscu_value = analysis.rscu(codon_use, aa_use)
-
-        data = pd.concat([data, pd.DataFrame([rscu_value], index=[names[i]])])
-
-    plt.figure(figsize=(21, 6))
-    plt.rcParams.update({'font.size': 14}) 
-    sns.heatmap(data, annot=False, cmap='RdBu', center=1, vmax=2)
-    plt.xlabel('Codon')
-    plt.ylabel('Gene/Organism')
-    plt.title(title)
-    plt.tight_layout()
-    plt.margins(x=0.01)
-    
-    # save figure and close plot
-    plt.savefig(filename, dpi=300, bbox_inches='tight') 
-    plt.close()
+def rscu_heatmap(names, codon_counts, title, filename, max_rows=None, reduce='sample', code=None, order='input',
+                 metric='euclidean'):
+    if render['format'] is None:
+        return
+    import seaborn as sns
+    import pandas as pd
+
+    # rscu of every sequence in one pass, N x 64
+    values = analysis.rscu_values(codon_counts, code=code)
+    names = list(names)
+
+    if max_rows is not None and len(names) > max_rows:
+        n_sequences = len(names)
+        if not isinstance(order, str):
+            order = 'cluster'   # the given order is of the sequences, not of the rows drawn for them
+        if reduce == 'sample':
+            keep = np.linspace(0, len(names) - 1, max_rows).astype(int)
+            values = values[keep]
+            names = [names[i] for i in keep]
+        elif reduce == 'group':
+            labels = analysis.group_rows(values, max_rows)
+            groups, first, sizes = np.unique(labels, return_index=True, return_counts=True)
+            sums = np.zeros((max_rows, 64))
+            np.add.at(sums, labels, values)
+            values = sums[groups] / sizes[:, None]
+            names = [f'{names[i]} (+{size - 1})' if size > 1 else names[i] for i, size in zip(first, sizes)]
+        else:
+            raise ValueError(f"reduce must be 'sample' or 'group', not {reduce!r}")
+        how = 'sampled' if reduce == 'sample' else 'grouped'
+        title = f'{title} ({len(names)} rows, {how} from {n_sequences} sequences)'.lstrip()
+        print(f"RSCU heatmap: {n_sequences} sequences {how} into {len(names)} rows")
+
+    if not isinstance(order, str):
+        rows = np.asarray(order)
+        values = values[rows]
+        names = [names[i] for i in rows]
+    elif order == 'cluster' and len(values)**2 * 4 > distance.linkage_max_bytes:
+        print(f"RSCU heatmap: too many rows to cluster in memory ({len(values)}), drawn in input order")
+    elif order == 'cluster':
+        # the drawn rows are clustered, so this stays cheap when there are many sequences
+        rows = distance.cluster_order(values, metric)
+        values = values[rows]
+        names = [names[i] for i in rows]
+    elif order != 'input':
+        raise ValueError(f"order must be 'input' or 'cluster', not {order!r}")
+
+    data = pd.DataFrame(values, index=names, columns=analysis.codon_list)
+
+    with matplotlib.rc_context({'font.size': 14}):
+        fig = get_figure('rscu_heatmap', (21, 6))
+        ax = fig.subplots()
+        sns.heatmap(data, annot=False, cmap='RdBu', center=1, vmax=2, ax=ax)
+        ax.set_xlabel('Codon')
+        ax.set_ylabel('Gene/Organism')
+        ax.set_title(title)
+        fig.tight_layout()
+        ax.margins(x=0.01)
+
+        # save figure
+        save(fig, filename, bbox_inches='tight')
     print(f"RSCU heatmap saved to {filename}")
 
 """
@@ -169,58 +334,107 @@ X-axis = sequence
 Y-axis = ENC
 
 :param list names: names of the sequences (row labels)
-:param list seqs: sequences to be analyzed
+:param codon_counts: N x 64 codon count matrix, one row per sequence (see analysis.codon_count_matrix)
 :param str title: title for the plot
 :param str filename: file name for plot to be saved to
+:param GeneticCode code: genetic code to group synonymous codons by (see genetic_codes), None for the standard code
+:param str method: 'wright' or 'novembre', see analysis.enc_values
 """
-def enc(seq_names, seqs, title, filename):
-    values = [analysis.enc(seq) for seq in seqs]
-
-    plt.rcParams.update({'font.size': 14}) 
-    fig, ax = plt.subplots(figsize=(8, 7)) # TODO: maybe have equation for width to make it wider if there are more seqs
-    bars = ax.bar(seq_names, values)
-    ax.bar_label(bars, fmt='%d')
-
-    ax.set_xlabel('Sequence')
-    ax.set_ylabel('ENC')
-    ax.set_ylim(0, max(values) * 1.1) # add 10% headroom to bars for labels
-    ax.set_title(title)
-
-    # save figure and close plot
-    fig.savefig(filename, dpi=300) 
-    plt.close()
+def enc(seq_names, codon_counts, title, filename, code=None, method='wright'):
+    if render['format'] is None:
+        return
+
+    values = analysis.enc_values(codon_counts, code, method)
+
+    with matplotlib.rc_context({'font.size': 14}):
+        fig = get_figure('enc', (8, 7)) # TODO: maybe have equation for width to make it wider if there are more seqs
+        ax = fig.subplots()
+        bars = ax.bar(seq_names, values)
+        ax.bar_label(bars, fmt='%.1f')
+
+        ax.set_xlabel('Sequence')
+        ax.set_ylabel('ENC')
+        # add 10% headroom to bars for labels, sequences too short for an ENC are nan
+        top = np.nanmax(values) if np.isfinite(values).any() else 61
+        ax.set_ylim(0, top * 1.1)
+        ax.set_title(title)
+
+        # save figure
+        save(fig, filename)
     print(f"ENC bar plot saved to {filename}")
 
 """
-Scatterplot of ENC vs GC content of codon position 3 for multiple sequences
-X-axis = GC3
+Scatterplot of ENC vs GC content of synonymous codon position 3 (GC3s) for multiple sequences, with Wright's
+expected ENC if codon usage only depended on GC3s: ENC = 2 + s + 29 / (s^2 + (1 - s)^2)
+X-axis = GC3s
 Y-axis = ENC
 
 :param list names: names of the sequences (point labels)
-:param list seqs: sequences to be analyzed
+:param codon_counts: N x 64 codon count matrix, one row per sequence (see analysis.codon_count_matrix)
 :param str title: title for the plot
 :param str filename: file name for plot to be saved to
+:param GeneticCode code: genetic code to group synonymous codons by (see genetic_codes), None for the standard code
+:param str method: 'wright' or 'novembre', see analysis.enc_values
 """
-def enc_vs_gc3(names, seqs, title, filename):
-    gc3 = [analysis.gc(seq) for seq in seqs]
-    enc = [analysis.enc(seq) for seq in seqs]
-    
-    fig, ax = plt.subplots()
-    ax.scatter(gc3, enc)
+def enc_vs_gc3(names, codon_counts, title, filename, code=None, method='wright'):
+    if render['format'] is None:
+        return
+
+    gc3 = analysis.gc3s_values(codon_counts, code)
+    enc = analysis.enc_values(codon_counts, code, method)
 
-    # add labels to each point
-    # TODO: make the labels a legend or only show when hover over or something
-    for x, y, label in zip(gc3, enc, names):
-        ax.text(x, y, label, fontsize=10, ha='right', va='bottom')
+    with matplotlib.rc_context({'font.size': 14}):
+        fig = get_figure('enc_vs_gc3', (6.4, 4.8))
+        ax = fig.subplots()
+        s = np.linspace(0, 1, 101)
+        ax.plot(s * 100, 2 + s + 29 / (s**2 + (1 - s)**2), color='gray', linewidth=1)
+        ax.scatter(gc3, enc)
 
-    ax.set_xlabel('GC3  (%)')
-    ax.set_ylabel('ENC')
-    ax.set_title(title)
+        # add labels to each point
+        # TODO: make the labels a legend or only show when hover over or something
+        for x, y, label in zip(gc3, enc, names):
+            ax.text(x, y, label, fontsize=10, ha='right', va='bottom')
 
-    plt.tight_layout()
+        ax.set_xlabel('GC3s  (%)')
+        ax.set_ylabel('ENC')
+        ax.set_title(title)
 
-     # save figure and close plot
-    fig.savefig(filename, dpi=300) 
-    plt.close()
+        fig.tight_layout()
+
+        # save figure
+        save(fig, filename)
     print(f"ENC vs GC3 scatterplot saved to {filename}")
 
+
+"""
+Line graphs of local codon usage along a sequence: GC3, GC3s and ENC of every sliding window of codons
+Long tracks are downsampled to the figure's pixel width (see minmax_downsample)
+
+:param dict tracks: see windows.codon_window_tracks
+:param str filename: file name for plot to be saved to
+"""
+def codon_windows(tracks: dict, filename: str):
+    if render['format'] is None or not len(tracks['enc']):
+        return
+
+    width = min(8 + int(3 * tracks['end'][-1] / 500), gc_max_width)
+    n_buckets = int(width * render['dpi'])
+    with matplotlib.rc_context({'font.size': 14}):
+        fig = get_figure('codon_windows', (width, 8))
+        axes = fig.subplots(2, 1, sharex=True)
+        # x is the base the window starts at, taken from the window starts since windows skip the CDS boundaries
+        for name, label in (('gc3', 'GC3'), ('gc3s', 'GC3s')):
+            index, y = minmax_downsample(tracks[name], n_buckets)
+            axes[0].plot(3 * tracks['start'][index - 1] + 1, y, label=label)
+        axes[0].set_ylabel('GC Content (%)')
+        axes[0].legend()
+        index, y = minmax_downsample(tracks['enc'], n_buckets)
+        axes[1].plot(3 * tracks['start'][index - 1] + 1, y)
+        axes[1].set_ylabel('ENC')
+        axes[1].set_xlabel('Window Start (Base Index)')
+        axes[0].set_title(f"Codon Usage in Windows of {tracks['end'][0] - tracks['start'][0]} Codons")
+        fig.tight_layout()
+
+        # save figure
+        save(fig, filename)
+    print(f"Codon window plot saved to {filename}")
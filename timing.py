@@ -0,0 +1,104 @@
+# per stage timing of the pipeline: wall time, call counts, bytes written, and optional cProfile / tracemalloc profiles
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+"""
+Collects wall time, number of calls and bytes written for each named stage of the pipeline
+
+With profile='cprofile' each stage also gets its own cProfile profile, with profile='tracemalloc'
+the peak traced memory of each stage is recorded. Stages must not be nested.
+"""
+class StageTimer:
+    """
+    :param str profile: None, 'cprofile' or 'tracemalloc'
+    """
+    def __init__(self, profile=None):
+        if profile not in (None, 'cprofile', 'tracemalloc'):
+            raise ValueError(f"profile must be None, 'cprofile' or 'tracemalloc', not {profile!r}")
+        self.profile = profile
+        self.stages = {}
+        self.profiles = {}
+        if profile == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    """
+    Context manager timing one call of a stage, the yielded dict's 'bytes' can be increased by the bytes the stage wrote
+
+    :param str name: name of the stage, for example 'count' or 'render'
+    """
+    @contextmanager
+    def stage(self, name: str):
+        record = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+        written = {'bytes': 0}
+        if self.profile == 'cprofile':
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+        elif self.profile == 'tracemalloc':
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield written
+        finally:
+            record['seconds'] += time.perf_counter() - start
+            record['calls'] += 1
+            record['bytes'] += written['bytes']
+            if self.profile == 'cprofile':
+                self.profiles[name].disable()
+            elif self.profile == 'tracemalloc':
+                peak = tracemalloc.get_traced_memory()[1]
+                record['peak_traced_bytes'] = max(record.get('peak_traced_bytes', 0), peak)
+
+    """
+    Adds the stage records collected by another timer (for example in a worker process)
+
+    :param dict stages: the other timer's stages
+    """
+    def merge(self, stages: dict):
+        for name, other in stages.items():
+            record = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+            for key, value in other.items():
+                if key == 'peak_traced_bytes':
+                    record[key] = max(record.get(key, 0), value)
+                else:
+                    record[key] = record.get(key, 0) + value
+
+    """
+    Builds the summary of all stages
+
+    :param float total_seconds: wall time of the whole run, to report each stage's share of it
+    :return: summary, stages are listed slowest first
+    :rtype: dict
+    """
+    def summary(self, total_seconds=None):
+        stages = dict(sorted(self.stages.items(), key=lambda item: item[1]['seconds'], reverse=True))
+        result = {'stages': stages}
+        if total_seconds is not None:
+            result['total_seconds'] = total_seconds
+            for record in stages.values():
+                record['share'] = record['seconds'] / total_seconds if total_seconds else 0.0
+        return result
+
+    """
+    Writes the summary to a JSON file and, with cProfile on, one profile_<stage>.prof file per stage
+    (open them with python -m pstats or snakeviz)
+
+    :param str output_dir: folder to write to
+    :param float total_seconds: wall time of the whole run
+    :return: the summary
+    :rtype: dict
+    """
+    def dump(self, output_dir: str, total_seconds=None):
+        result = self.summary(total_seconds)
+        for name, profile in self.profiles.items():
+            path = os.path.join(output_dir, f'profile_{name}.prof')
+            profile.dump_stats(path)
+            result['stages'][name]['profile'] = path
+        path = os.path.join(output_dir, 'timing.json')
+        with open(path, 'w') as file:
+            json.dump(result, file, indent=2)
+        print(json.dumps(result, indent=2))
+        print(f"Timing summary saved to {path}")
+        return result
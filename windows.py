@@ -0,0 +1,139 @@
+# codon usage along a sequence: the 64 codon counts of every sliding window of codons, kept up to date by adding the
+# codons that enter a window and removing the ones that leave it, and the local GC3, GC3s, ENC and RSCU tracks derived
+# from them (for example to find genomic islands or horizontally transferred regions)
+import numpy as np
+import analysis
+import orf
+
+# columns of the track table written by write_tracks, followed by the rscu columns if there are any
+track_columns = ['start', 'end', 'codons', 'invalid_codons', 'gc3', 'gc3s', 'enc']
+
+"""
+Converts a sequence to the codon slots of each of its coding sequences, in reading order
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds: CDS tuples (parts, strand) (see orf), None for the whole sequence
+:return: one array of codon slots (see analysis.codon_indices) per CDS, or one for the whole sequence;
+         64 and up for codons with an invalid base
+:rtype: list
+"""
+def cds_codon_slots(sequence, cds=None):
+    if cds is None:
+        return [analysis.codon_indices(sequence)]
+    codes = orf.base_code_array(sequence)
+    return [orf.cds_codon_codes(codes, part) @ analysis.codon_slot_weights for part in cds]
+
+"""
+Converts a sequence to its codon slots in reading order, over the whole sequence or over its coding sequences
+
+:param sequence: the dna or rna sequence, as a str or bytes
+:param list cds: CDS tuples (parts, strand) whose codons are joined in order (see orf), None for the whole sequence
+:return: codon slots (see analysis.codon_indices), 64 and up for codons with an invalid base
+:rtype: numpy.ndarray
+"""
+def sequence_codon_slots(sequence, cds=None):
+    slots = cds_codon_slots(sequence, cds)
+    return np.concatenate(slots) if slots else np.zeros(0, dtype=np.intp)
+
+"""
+Generator over the codon counts of every window of window_codons codons, starting every step_codons codons
+Only the first window is counted, each next one is the previous one plus the codons that enter it minus the codons
+that leave it, so the total work is O(number of codons + 65 x number of windows). The counts are built block_windows
+windows at a time so memory stays bounded for genome length inputs
+
+:param numpy.ndarray slots: codon slots (see sequence_codon_slots)
+:param int window_codons: number of codons in each window
+:param int step_codons: distance between the starts of consecutive windows, in codons
+:param int block_windows: number of windows per yielded block
+:return: yields blocks of window x 65 counts, column i < 64 counts codon_list[i], column 64 the codons with an
+         invalid base; window i starts at codon i * step_codons
+:rtype: generator
+"""
+def codon_windows(slots, window_codons: int, step_codons: int = 1, block_windows: int = 4096):
+    if window_codons < 1 or step_codons < 1:
+        raise ValueError(f"window_codons and step_codons must be at least 1, not {window_codons} and {step_codons}")
+    slots = np.minimum(np.asarray(slots), 64)
+    if len(slots) < window_codons:
+        return
+    n_windows = (len(slots) - window_codons) // step_codons + 1
+    w, s = window_codons, step_codons
+    state = np.zeros(65, dtype=np.int64)    # counts of the window before the block
+
+    for first in range(0, n_windows, block_windows):
+        last = min(first + block_windows, n_windows)
+        rows = last - first
+        delta = np.zeros(rows * 65, dtype=np.int64)
+        if first == 0:
+            # the first window is counted in full, as the change from an empty window
+            delta[:65] = np.bincount(slots[:w], minlength=65)
+        moved = max(first, 1)
+        if moved < last:
+            # window j gains codons (j-1)*s + w .. j*s + w and loses codons (j-1)*s .. j*s
+            entering = np.arange((moved - 1) * s + w, (last - 1) * s + w)
+            leaving = np.arange((moved - 1) * s, (last - 1) * s)
+            delta += np.bincount(((entering - w) // s + 1 - first) * 65 + slots[entering], minlength=rows * 65)
+            delta -= np.bincount((leaving // s + 1 - first) * 65 + slots[leaving], minlength=rows * 65)
+        counts = np.cumsum(delta.reshape(rows, 65), axis=0) + state
+        state = counts[-1]
+        yield counts
+
+"""
+Computes local codon usage tracks: GC3, GC3s, ENC and optionally RSCU of every sliding window of codons
+Given one array of codon slots per CDS, the windows stay within each CDS; their positions count the codons of all
+the CDS joined in order
+
+:param slots: codon slots (see sequence_codon_slots), or a list of codon slot arrays (see cds_codon_slots)
+:param int window_codons: number of codons in each window
+:param int step_codons: distance between the starts of consecutive windows, in codons
+:param GeneticCode code: genetic code to group synonymous codons by (see genetic_codes), None for the standard code
+:param str method: ENC method, 'wright' or 'novembre' (see analysis.enc_values)
+:param bool rscu: True to also return the RSCU of every window (windows x 64, float32)
+:return: start and end (first codon and one past the last codon of each window, 0 based), codons (valid codons),
+         invalid_codons, gc3, gc3s, enc, and rscu if asked for, one value (or row) per window
+:rtype: dict
+"""
+def codon_window_tracks(slots, window_codons: int = 100, step_codons: int = 10, code=None, method: str = 'wright',
+                        rscu: bool = False):
+    if not isinstance(slots, list):
+        slots = [slots]
+    blocks = {'start': [], 'codons': [], 'invalid_codons': [], 'gc3': [], 'gc3s': [], 'enc': [], 'rscu': []}
+    offset = 0      # position of the first codon of the current array
+    for part in slots:
+        n_windows = 0
+        for counts in codon_windows(part, window_codons, step_codons):
+            valid = counts[:, :64]
+            blocks['start'].append(offset + (n_windows + np.arange(len(counts))) * step_codons)
+            n_windows += len(counts)
+            blocks['codons'].append(valid.sum(axis=1))
+            blocks['invalid_codons'].append(counts[:, 64])
+            blocks['gc3'].append(analysis.gc3_values(valid))
+            blocks['gc3s'].append(analysis.gc3s_values(valid, code))
+            blocks['enc'].append(analysis.enc_values(valid, code, method))
+            if rscu:
+                blocks['rscu'].append(analysis.rscu_values(valid, code=code).astype(np.float32))
+        offset += len(part)
+
+    start = np.concatenate(blocks['start']) if blocks['start'] else np.zeros(0, dtype=np.intp)
+    tracks = {'start': start, 'end': start + window_codons}
+    for name in ('codons', 'invalid_codons', 'gc3', 'gc3s', 'enc'):
+        tracks[name] = np.concatenate(blocks[name]) if blocks[name] else np.zeros(0)
+    if rscu:
+        tracks['rscu'] = np.concatenate(blocks['rscu']) if blocks['rscu'] else np.zeros((0, 64), dtype=np.float32)
+    return tracks
+
+"""
+Writes codon usage tracks to a tab separated file, one row per window (positions are codons, see codon_window_tracks)
+
+:param dict tracks: see codon_window_tracks
+:param str path: file to write
+"""
+def write_tracks(tracks: dict, path: str):
+    columns = [tracks[name] for name in track_columns]
+    header = list(track_columns)
+    formats = ['%d'] * 4 + ['%.4f'] * 3
+    if 'rscu' in tracks:
+        columns.extend(tracks['rscu'].T)
+        header.extend(f'rscu_{codon}' for codon in analysis.codon_list)
+        formats.extend(['%.4f'] * 64)
+    np.savetxt(path, np.column_stack(columns) if len(columns[0]) else np.zeros((0, len(header))), fmt=formats,
+               delimiter='\t', header='\t'.join(header), comments='')